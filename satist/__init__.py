@@ -1,6 +1,6 @@
 from . import tools
 from .cadence import SimpleCadence
-from .catalog import GaiaStarCatalog, MockStarCatalog
+from .catalog import ColumnarGaiaStarCatalog, GaiaStarCatalog, MockStarCatalog
 from .instrument import Instrument
 from .tracker import InertialTracker, OrbitTracker, SiderealTracker
 from .wcs import radialWCS
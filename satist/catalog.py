@@ -2,76 +2,287 @@
 Star catalog interfaces for optical observations of satellites.
 """
 
+import functools
+import glob
 import os
+import threading
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 
 import astropy.units as u
 import lsst.sphgeom as sphgeom
+import yaml
 from astropy.table import Table, vstack
-from ssapy.utils import catalog_to_apparent
-from .photometry import get_gaia_magnitude_histogram, vega_to_ab_offset
+from astropy.time import Time
+from ssapy.utils import normed
+from .photometry import load_gaia_magnitude_histogram, vega_to_ab_offset
+
+# The Earth's barycentric position and velocity change by a negligible amount
+# over this many seconds (~1e-4 arcsec of aberration), so apparent positions of
+# frames taken close together in time share them.
+_EARTH_STATE_INTERVAL = 60.0
+
+
+@functools.lru_cache(maxsize=64)
+def _earth_state(interval):
+    """Get the Earth's barycentric position and velocity.
 
-def _coord_to_UV3d(coord):
-    """Convert a coordinate to an LSST spherical geometry UnitVector3d.
-    
     Parameters
     ----------
-    coord : galsim.CelestialCoord
-        Coordinate to convert
-        
+    interval : int
+        Index of the _EARTH_STATE_INTERVAL-second interval of GPS time at
+        whose center to evaluate the state
+
     Returns
     -------
-    sphgeom.UnitVector3d
-        Unit vector representation of the coordinate
+    pos : array (3,)
+        Position in AU
+    vel : array (3,)
+        Velocity in m/s
     """
-    return sphgeom.UnitVector3d(*coord.get_xyz())
+    from astropy.coordinates import get_body_barycentric_posvel
 
+    t = Time((interval + 0.5)*_EARTH_STATE_INTERVAL, format='gps')
+    pos, vel = get_body_barycentric_posvel('earth', t)
+    return pos.xyz.to(u.AU).value, vel.xyz.to(u.m/u.s).value
+
+
+@functools.lru_cache(maxsize=1)
+def _j2000_gps():
+    return Time("J2000").gps
+
+
+def _catalog_to_apparent(ra, dec, time, pmra, pmdec, parallax):
+    """Convert catalog (ICRS) positions of stars to apparent positions.
+
+    Same as ssapy.utils.catalog_to_apparent without diurnal aberration, but
+    reuses the Earth's state for times within the same _EARTH_STATE_INTERVAL.
 
-def _circle_to_poly(circle, nvertex=100):
-    """Convert a spherical circle to a convex polygon approximation.
-    
     Parameters
     ----------
-    circle : sphgeom.Circle
-        Spherical circle to convert
-    nvertex : int, optional
-        Number of vertices to use for polygon approximation (default: 100)
-        
+    ra, dec : array_like
+        J2000 right ascension and declination in radians
+    time : astropy.time.Time or float
+        Time of observation.  If float, then GPS seconds.
+    pmra, pmdec : array_like
+        Proper motion in right ascension / declination in milliarcsec per year
+    parallax : array_like
+        Annual parallax in arcseconds
+
     Returns
     -------
-    sphgeom.ConvexPolygon
-        Polygon approximation of the circle
+    ra, dec : array_like
+        Apparent right ascension and declination in radians
     """
-    center = circle.getCenter()
-    # Start with point towards the east and `opening-angle` away.
-    point = center.rotatedAround(
-        sphgeom.UnitVector3d.northFrom(center),
-        circle.getOpeningAngle()
-    )
-    # Now rotate that point around circle center, mapping out a ~circle.
-    th = np.linspace(0, 2*np.pi, nvertex)
-    points = [
-        point.rotatedAround(center, sphgeom.Angle.fromRadians(th_))
-        for th_ in th
-    ]
-    return sphgeom.ConvexPolygon(points)
+    t = time.gps if isinstance(time, Time) else time
+    pob, vob = _earth_state(int(np.floor(t/_EARTH_STATE_INTERVAL)))
+
+    # Following ssapy.utils.catalog_to_apparent (SOFA iauPmpx, iauAb)
+    sr, cr = np.sin(ra), np.cos(ra)
+    sd, cd = np.sin(dec), np.cos(dec)
+    x = cr * cd
+    y = sr * cd
+    z = sd
+    p = np.array([x, y, z]).T
+    dt = (t - _j2000_gps()) / (86400 * 365.25)
+    pdrad = np.deg2rad(pmdec / (1000 * 3600))
+    prrad = np.deg2rad(pmra / (1000 * 3600)) / cd
+    pxrad = np.deg2rad(parallax / 3600)
+
+    # Proper motion and parallax
+    pdz = z * pdrad
+    pm = np.array([
+        -prrad * y - pdz * cr,
+        prrad * x - pdz * sr,
+        pdrad * cd
+    ]).T
+    p += dt * pm - pxrad[..., None] * pob
+    p = normed(p)
+
+    # Annual aberration
+    p += vob / 299792458.
+    p = normed(p)
+
+    return np.arctan2(p[:, 1], p[:, 0]), np.arcsin(p[:, 2])
+
+
+def _swept_cap_envelope(htm, p0, p1, radius):
+    """Find the trixels overlapping a cap swept along a great-circle arc.
+
+    Parameters
+    ----------
+    htm : sphgeom.HtmPixelization
+        Pixelization to use
+    p0, p1 : array_like (3,)
+        Unit vectors of the cap center at the start/end of the arc
+    radius : float
+        Cap radius in radians
+
+    Returns
+    -------
+    sphgeom.RangeSet
+        Trixel indices overlapping the swept cap
+    """
+    # Cover the arc with caps whose centers are at most `step` apart.  Every
+    # point within radius of the arc is then within radius + step/2 of one of
+    # the centers.
+    arc = np.arccos(np.clip(np.dot(p0, p1), -1, 1))
+    n = int(np.ceil(arc/radius)) + 1
+    step = arc/(n-1) if n > 1 else 0.0
+    angle = sphgeom.Angle.fromRadians(radius + 0.5*step)
+    ranges = sphgeom.RangeSet()
+    for t in np.linspace(0, 1, n):
+        if arc > 0:
+            center = np.sin((1-t)*arc)*p0 + np.sin(t*arc)*p1
+        else:
+            center = p0
+        ranges = ranges | htm.envelope(
+            sphgeom.Circle(sphgeom.UnitVector3d(*center), angle)
+        )
+    return ranges
+
+
+def _in_swept_cap(ra, dec, p0, p1, radius):
+    """Test which points lie within a cap swept along a great-circle arc.
+
+    Parameters
+    ----------
+    ra, dec : array_like
+        Coordinates of points to test in radians
+    p0, p1 : array_like (3,)
+        Unit vectors of the cap center at the start/end of the arc
+    radius : float
+        Cap radius in radians
+
+    Returns
+    -------
+    array of bool
+        Whether each point is within radius of the arc
+    """
+    cd = np.cos(dec)
+    q = np.array([cd*np.cos(ra), cd*np.sin(ra), np.sin(dec)]).T
+    cr = np.cos(radius)
+    inside = (q @ p0 >= cr) | (q @ p1 >= cr)
+    normal = np.cross(p0, p1)
+    norm = np.sqrt(np.sum(normal**2))
+    if norm > 1e-15:
+        normal /= norm
+        # Points whose projection onto the great circle lies between p0 and
+        # p1 are within radius of the arc if they're within radius of the
+        # great circle.
+        on_arc = (q @ np.cross(normal, p0) >= 0) & (q @ np.cross(p1, normal) >= 0)
+        inside |= on_arc & (np.abs(q @ normal) <= np.sin(radius))
+    return inside
+
+
+class TrixelCache:
+    """Memory-bounded least-recently-used cache of per-trixel star tables.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Maximum total size of the cached tables in bytes.  Tables larger than
+        this are never cached.
+
+    Notes
+    -----
+    Safe to use from multiple threads.  Loads run outside the lock, so
+    different trixels can be loaded concurrently.
+
+    Attributes
+    ----------
+    hits, misses : int
+        Number of lookups served from / not found in the cache
+    nbytes : int
+        Current total size of the cached tables in bytes
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tables)
+
+    def get(self, idx, load):
+        """Get the table for a trixel, loading and caching it if necessary.
+
+        Parameters
+        ----------
+        idx : int
+            HTM trixel index
+        load : callable
+            Function of idx returning the trixel table on a cache miss
+
+        Returns
+        -------
+        astropy.table.Table
+            Table of stars in the trixel.  Shared with the cache, so don't
+            modify it in place.
+        """
+        with self._lock:
+            if idx in self._tables:
+                self.hits += 1
+                self._tables.move_to_end(idx)
+                return self._tables[idx]
+            self.misses += 1
+        table = load(idx)
+        nbytes = sum(col.nbytes for col in table.itercols())
+        if nbytes > self.max_bytes:
+            return table
+        with self._lock:
+            if idx in self._tables:  # loaded concurrently by another thread
+                return self._tables[idx]
+            self._tables[idx] = table
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, old = self._tables.popitem(last=False)
+                self.nbytes -= sum(col.nbytes for col in old.itercols())
+        return table
+
+    def clear(self):
+        """Empty the cache and reset the hit/miss counters."""
+        with self._lock:
+            self._tables.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
 
 
 class StarCatalog(ABC):
     """Abstract base class for star catalogs using HTM pixelization.
+
+    Trixels are loaded through a `TrixelCache`, so repeated or overlapping
+    queries with the same catalog instance only read each trixel once.
     
     Parameters
     ----------
     level : int, optional
         HTM pixelization level (default: 7)
+    cache_size : int, optional
+        Maximum memory in bytes used to cache trixels (default: 256 MiB)
+    n_threads : int, optional
+        Number of threads used to load the trixels of a query concurrently.
+        Loading is I/O bound, so this hides file system latency (default: 1)
     """
-    def __init__(self, level=7):
+    def __init__(self, level=7, cache_size=256*2**20, n_threads=1):
         self.htm = sphgeom.HtmPixelization(level)
+        self.cache = TrixelCache(cache_size)
+        self.n_threads = n_threads
+        # Trixel envelopes of recent queries, for repeated pointings
+        self._envelopes = OrderedDict()
 
-    def get_stars(self, coord0, coord1, radius, time):
+    def get_stars(self, coord0, coord1, radius, time, mag_limit=None):
         """Get stars within a field of view, accounting for motion during exposure.
+
+        Returns the stars within radius of the great-circle arc traced by the
+        field center during the exposure.
         
         Parameters
         ----------
@@ -82,6 +293,9 @@ class StarCatalog(ABC):
         time : astropy.time.Time
             Time of observation (to account for proper motion, parallax,
             aberration)
+        mag_limit : float, optional
+            Only return stars with i_mag <= mag_limit.  Catalogs with
+            magnitude-sorted trixels only read the stars passing the cut.
 
         Returns
         -------
@@ -91,40 +305,80 @@ class StarCatalog(ABC):
                 - dec (deg)
                 - i_mag
         """
-        c0 = sphgeom.Circle(
-            _coord_to_UV3d(coord0),
-            sphgeom.Angle.fromDegrees(radius.deg)
-        )
-        c1 = sphgeom.Circle(
-            _coord_to_UV3d(coord1),
-            sphgeom.Angle.fromDegrees(radius.deg)
-        )
-        poly0 = _circle_to_poly(c0)
-        poly1 = _circle_to_poly(c1)
-        poly = sphgeom.ConvexPolygon(poly0.getVertices() + poly1.getVertices())
-
-        htm = sphgeom.HtmPixelization(7)
-        ranges = htm.envelope(poly)
-        table_list = []
-        for start, end in ranges:
-            for idx in range(start, end):
-                table_list.append(self._get_trixel_stars(idx, time))
-        out = vstack(table_list)
-        w = poly.contains(out['ra_rad'], out['dec_rad'])
+        p0 = np.array(coord0.get_xyz())
+        p1 = np.array(coord1.get_xyz())
+        key = (*p0, *p1, radius.rad)
+        if key not in self._envelopes:
+            self._envelopes[key] = _swept_cap_envelope(
+                self.htm, p0, p1, radius.rad
+            )
+            if len(self._envelopes) > 128:
+                self._envelopes.popitem(last=False)
+        ranges = self._envelopes[key]
+
+        # Gather the catalog data of all trixels first, so the time-dependent
+        # transformation is done in one vectorized pass.
+        idxs = [idx for start, end in ranges for idx in range(start, end)]
+        get = functools.partial(self._get_trixel_stars, mag_limit=mag_limit)
+        if self.n_threads > 1 and len(idxs) > 1:
+            # map yields in idxs order, so the output doesn't depend on which
+            # load finishes first.
+            with ThreadPoolExecutor(
+                max_workers=min(self.n_threads, len(idxs))
+            ) as executor:
+                table_list = list(executor.map(get, idxs))
+        else:
+            table_list = [get(idx) for idx in idxs]
+        out = self._to_apparent(vstack(table_list), time)
+        w = _in_swept_cap(out['ra_rad'], out['dec_rad'], p0, p1, radius.rad)
         out = out[w]
         return out
 
-    @abstractmethod
-    def _get_trixel_stars(self, idx, time):
-        """Get stars from a single HTM trixel.
+    def _get_trixel_stars(self, idx, mag_limit=None):
+        """Get catalog data of stars from a single HTM trixel.
         
         Parameters
         ----------
         idx : int
             HTM trixel index
-        time : astropy.time.Time
-            Time of observation
+        mag_limit : float, optional
+            Faintest i_mag to include
             
+        Returns
+        -------
+        astropy.table.Table
+            Table of stars in the trixel, before `_to_apparent`
+        """
+        table = self.cache.get(idx, self._load_trixel)
+        if mag_limit is not None:
+            table = self._brighter_than(table, mag_limit)
+        return table
+
+    def _brighter_than(self, table, mag_limit):
+        """Select stars with i_mag <= mag_limit from a trixel table.
+
+        Parameters
+        ----------
+        table : astropy.table.Table
+            Output of `_load_trixel`
+        mag_limit : float
+            Faintest i_mag to include
+
+        Returns
+        -------
+        astropy.table.Table
+        """
+        return table[table['i_mag'] <= mag_limit]
+
+    @abstractmethod
+    def _load_trixel(self, idx):
+        """Load the time-independent catalog data of a single HTM trixel.
+
+        Parameters
+        ----------
+        idx : int
+            HTM trixel index
+
         Returns
         -------
         astropy.table.Table
@@ -132,6 +386,23 @@ class StarCatalog(ABC):
         """
         pass
 
+    def _to_apparent(self, table, time):
+        """Transform catalog data to apparent positions at a time.
+
+        Parameters
+        ----------
+        table : astropy.table.Table
+            Stacked outputs of `_load_trixel`
+        time : astropy.time.Time
+            Time of observation
+
+        Returns
+        -------
+        astropy.table.Table
+            Table of stars with apparent positions
+        """
+        return table
+
 
 class MockStarCatalog(StarCatalog):
     """A mock star catalog created on-the-fly in memory, but consistently (same
@@ -143,6 +414,18 @@ class MockStarCatalog(StarCatalog):
         HTM level for pixelization (default: 7)
     seed : int, optional
         Random seed for initialization (default: 123)
+    cache_size : int, optional
+        Maximum memory in bytes used to cache trixels (default: 256 MiB)
+    n_threads : int, optional
+        Number of threads used to generate trixels (default: 1)
+    gaia_mags : bool, optional
+        Add G, BP and RP magnitude columns sampled from the Gaia magnitude
+        histograms (default: False).  The histograms are loaded when the
+        first trixel is generated, not before.
+    allow_query : bool, optional
+        Query the Gaia archive for the magnitude histograms if the copy
+        bundled with the package is missing (default: False, raise
+        FileNotFoundError)
 
     Notes
     -----
@@ -151,8 +434,11 @@ class MockStarCatalog(StarCatalog):
     star catalog is fixed.  With a different level or seed, the catalog will
     change.
     """
-    def __init__(self, level=7, seed=123):
-        super().__init__(level=level)
+    def __init__(self, level=7, seed=123, cache_size=256*2**20, n_threads=1,
+                 gaia_mags=False, allow_query=False):
+        super().__init__(
+            level=level, cache_size=cache_size, n_threads=n_threads
+        )
         self.seed = seed
         # i magnitude histogram from limited area GAIA trixels
         self.imag_hist = np.array([
@@ -173,10 +459,17 @@ class MockStarCatalog(StarCatalog):
         self.bins = np.linspace(10, 21, 111)
         self.density = np.sum(self.imag_hist) / 0.102219849198379 # N / sr
 
-        self.magnitude_hists = get_gaia_magnitude_histogram()
-       
+        self.gaia_mags = gaia_mags
+        self.allow_query = allow_query
+
+    @property
+    def magnitude_hists(self):
+        """G, BP and RP magnitude histograms, see
+        `photometry.load_gaia_magnitude_histogram`.
+        """
+        return load_gaia_magnitude_histogram(allow_query=self.allow_query)
 
-    def _get_trixel_stars(self, idx, time):
+    def _load_trixel(self, idx):
         """Generate mock stars for a given HTM trixel.
         
         Generates a deterministic random star catalog based on the trixel index
@@ -187,8 +480,6 @@ class MockStarCatalog(StarCatalog):
         ----------
         idx : int
             HTM trixel index
-        time : astropy.time.Time
-            Time of observation (unused in mock catalog)
             
         Returns
         -------
@@ -199,7 +490,7 @@ class MockStarCatalog(StarCatalog):
                 - ra : RA in degrees
                 - dec : Dec in degrees
                 - i_mag : i-band magnitude
-                - {filter}_mag : Magnitude in GAIA filters
+                - {filter}_mag : Magnitude in GAIA filters, if gaia_mags
         """
         # Generate random deterministic star catalog anywhere on the sky on the
         # fly.
@@ -246,18 +537,20 @@ class MockStarCatalog(StarCatalog):
         i_mag = self.bins[indices] + rng.uniform(0, 0.1, size=N)
         table['i_mag'] = i_mag[w]
 
-        for gaia_filter in self.magnitude_hists:
-        
-            mag_hist = self.magnitude_hists[gaia_filter]['values']
-            bins = self.magnitude_hists[gaia_filter]['bins']
-            indices = rng.choice(
-                len(mag_hist),
-                p=mag_hist/np.sum(mag_hist),
-                size=N
-            )
-            mag = bins[indices] + rng.uniform(0, 0.1, size=N)
-            table[f'{filter}_mag'] = mag[w] + vega_to_ab_offset(gaia_filter)
-
+        if self.gaia_mags:
+            hists = self.magnitude_hists
+            for gaia_filter in hists:
+                mag_hist = hists[gaia_filter]['values']
+                bins = hists[gaia_filter]['bins']
+                indices = rng.choice(
+                    len(mag_hist),
+                    p=mag_hist/np.sum(mag_hist),
+                    size=N
+                )
+                mag = bins[indices] + rng.uniform(0, 0.1, size=N)
+                table[f'{gaia_filter}_mag'] = (
+                    mag[w] + vega_to_ab_offset(gaia_filter)
+                )
 
         table['ra'] = np.rad2deg(table['ra_rad'])
         table['dec'] = np.rad2deg(table['dec_rad'])
@@ -278,21 +571,71 @@ class GaiaStarCatalog(StarCatalog):
         Directory containing GAIA catalog trixel FITS files (named {idx}.fits)
     level : int, optional
         HTM pixelization level (default: 7)
+    cache_size : int, optional
+        Maximum memory in bytes used to cache trixels (default: 256 MiB)
+    n_threads : int, optional
+        Number of threads used to read trixel files concurrently (default: 1)
     """
-    def __init__(self, gaia_dir, level=7):
-        super().__init__(level=level)
+    def __init__(self, gaia_dir, level=7, cache_size=256*2**20, n_threads=1):
+        super().__init__(
+            level=level, cache_size=cache_size, n_threads=n_threads
+        )
         self.gaia_dir = gaia_dir
 
-    def _get_trixel_stars(self, idx, time):
-        """Load and transform GAIA stars from a single HTM trixel.
-        
-        Reads GAIA catalog data from disk and applies proper motion, parallax,
-        and aberration corrections to transform from ICRF to apparent coordinates.
-        
+    def _load_trixel(self, idx):
+        """Load GAIA stars from a single HTM trixel.
+
+        Reads GAIA catalog data from disk, drops stars without a positive G
+        flux, and converts the columns needed for the apparent transformation
+        to plain units.
+
         Parameters
         ----------
         idx : int
             HTM trixel index
+
+        Returns
+        -------
+        astropy.table.Table
+            Table with columns:
+                - coord_ra : ICRF RA in radians
+                - coord_dec : ICRF Dec in radians
+                - pm_ra : Proper motion in RA in milliarcsec
+                - pm_dec : Proper motion in Dec in milliarcsec
+                - parallax : Parallax in arcsec
+                - i_mag : i-band magnitude (currently G-band flux)
+        """
+        file = os.path.join(self.gaia_dir, f"{idx}.fits")
+        gaia_data = Table.read(file)
+        gaia_data = gaia_data[gaia_data['phot_g_mean_flux'] > 0.0]
+        table = Table()
+        table['coord_ra'] = gaia_data['coord_ra'].to(u.rad).value
+        table['coord_dec'] = gaia_data['coord_dec'].to(u.rad).value
+        table['pm_ra'] = gaia_data['pm_ra'].to(u.mas).value
+        table['pm_dec'] = gaia_data['pm_dec'].to(u.mas).value
+        table['parallax'] = gaia_data['parallax'].to(u.arcsec).value
+        # TODO: change line below for multiple filters
+        # g_coefficients = []
+        # r_coefficients = []
+        # i_coefficients = []
+        # TODO: logic for which filter
+        # if filter == 'i':
+        #    coefficients = i_coefficients
+        #    filter_name = 'i_mag'
+        # deltaG = 
+        # table[filter_name] = -(coefficients[0] - (coefficients[1] * deltaG))
+        table['i_mag'] = gaia_data['phot_g_mean_flux'].to(u.ABmag).value
+        return table
+
+    def _to_apparent(self, gaia_data, time):
+        """Transform GAIA stars from ICRF to apparent coordinates.
+        
+        Applies proper motion, parallax, and aberration corrections.
+        
+        Parameters
+        ----------
+        gaia_data : astropy.table.Table
+            Stacked outputs of `_load_trixel`
         time : astropy.time.Time
             Time of observation for coordinate transformations
             
@@ -306,8 +649,6 @@ class GaiaStarCatalog(StarCatalog):
                 - dec : Apparent Dec in degrees
                 - i_mag : i-band magnitude (currently G-band flux)
         """
-        file = os.path.join(self.gaia_dir, f"{idx}.fits")
-        gaia_data = Table.read(file)
         table = Table()
         # Apply transformations for proper motion, parallax, and aberration.
         # The pm and px transforms are tiny, but easy to include.  For
@@ -316,27 +657,176 @@ class GaiaStarCatalog(StarCatalog):
         # also include diurnal aberration and refraction here, but since these
         # equally affect stars and satellites, we simply leave them out and
         # don't calculate them for satellites either.
-        table['ra_rad'], table['dec_rad'] = catalog_to_apparent(
-            gaia_data['coord_ra'].to(u.rad).value,
-            gaia_data['coord_dec'].to(u.rad).value,
+        table['ra_rad'], table['dec_rad'] = _catalog_to_apparent(
+            np.asarray(gaia_data['coord_ra']),
+            np.asarray(gaia_data['coord_dec']),
             time,
-            observer=None,  # we don't want to include diurnal aberration
-            pmra=gaia_data['pm_ra'].to(u.mas).value,
-            pmdec=gaia_data['pm_dec'].to(u.mas).value,
-            parallax=gaia_data['parallax'].to(u.arcsec).value,
+            pmra=np.asarray(gaia_data['pm_ra']),
+            pmdec=np.asarray(gaia_data['pm_dec']),
+            parallax=np.asarray(gaia_data['parallax']),
         )
-        gaia_data = gaia_data[gaia_data['phot_g_mean_flux'] > 0.0]
-        # TODO: change line below for multiple filters
-        # g_coefficients = []
-        # r_coefficients = []
-        # i_coefficients = []
-        # TODO: logic for which filter
-        # if filter == 'i':
-        #    coefficients = i_coefficients
-        #    filter_name = 'i_mag'
-        # deltaG = 
-        # table[filter_name] = -(coefficients[0] - (coefficients[1] * deltaG))
-        table['i_mag'] = gaia_data['phot_g_mean_flux'].to(u.ABmag).value
+        table['i_mag'] = gaia_data['i_mag']
         table['ra'] = np.rad2deg(table['ra_rad'])
         table['dec'] = np.rad2deg(table['dec_rad'])
-        return table
\ No newline at end of file
+        return table
+
+
+# Columns (and their on-disk dtypes) kept by the columnar GAIA layout.  These
+# are exactly the columns GaiaStarCatalog._load_trixel produces.
+_COLUMNAR_DTYPES = {
+    'coord_ra': '<f8',
+    'coord_dec': '<f8',
+    'pm_ra': '<f4',
+    'pm_dec': '<f4',
+    'parallax': '<f4',
+    'i_mag': '<f4',
+}
+
+
+def convert_gaia_shards(gaia_dir, out_dir, level=7):
+    """Rewrite HTM-pixelized GAIA FITS shards into a columnar layout.
+
+    Each column GaiaStarCatalog needs is stored as a flat little-endian binary
+    file with the rows of all trixels concatenated in trixel order.  An index
+    of trixel ids and row offsets locates each trixel's rows, so the layout
+    can be memory-mapped and read without copying or unit conversion.  Within
+    each trixel, rows are sorted from bright to faint, so magnitude-limited
+    queries only read a prefix of each trixel.
+
+    Parameters
+    ----------
+    gaia_dir : str
+        Directory containing GAIA catalog trixel FITS files (named {idx}.fits)
+    out_dir : str
+        Output directory
+    level : int, optional
+        HTM pixelization level of the shards (default: 7)
+
+    Notes
+    -----
+    Creates the following files:
+        out_dir/
+            columns.yaml  (HTM level, row count, sort key and column dtypes)
+            trixels.npy  (sorted trixel ids)
+            offsets.npy  (row offsets; trixel i is rows offsets[i]:offsets[i+1])
+            {column}.bin  (one raw binary file per column)
+    """
+    from tqdm import tqdm
+
+    os.makedirs(out_dir, exist_ok=True)
+    trixels = sorted(
+        int(os.path.basename(file)[:-len(".fits")])
+        for file in glob.glob(os.path.join(gaia_dir, "*.fits"))
+    )
+    reader = GaiaStarCatalog(gaia_dir, level=level, cache_size=0)
+    offsets = [0]
+    files = {
+        name: open(os.path.join(out_dir, f"{name}.bin"), "wb")
+        for name in _COLUMNAR_DTYPES
+    }
+    try:
+        for idx in tqdm(trixels):
+            table = reader._load_trixel(idx)
+            table = table[np.argsort(table['i_mag'], kind='stable')]
+            for name, dtype in _COLUMNAR_DTYPES.items():
+                files[name].write(
+                    np.ascontiguousarray(table[name], dtype=dtype).tobytes()
+                )
+            offsets.append(offsets[-1] + len(table))
+    finally:
+        for f in files.values():
+            f.close()
+
+    np.save(os.path.join(out_dir, "trixels.npy"), np.array(trixels, dtype=np.int64))
+    np.save(os.path.join(out_dir, "offsets.npy"), np.array(offsets, dtype=np.int64))
+    with open(os.path.join(out_dir, "columns.yaml"), "w") as f:
+        yaml.safe_dump(
+            dict(
+                level=level, nrows=offsets[-1], sorted_by='i_mag',
+                columns=_COLUMNAR_DTYPES
+            ),
+            f
+        )
+
+
+class ColumnarGaiaStarCatalog(GaiaStarCatalog):
+    """GAIA star catalog read from the memory-mapped columnar layout.
+
+    Behaves like GaiaStarCatalog, but reads the layout written by
+    `convert_gaia_shards`.  Trixel tables are views into the memory-mapped
+    column files, so loading a trixel involves no parsing, copying or unit
+    conversion.
+
+    Parameters
+    ----------
+    columnar_dir : str
+        Directory written by `convert_gaia_shards`
+    cache_size : int, optional
+        Maximum memory in bytes used to cache trixels (default: 256 MiB)
+    n_threads : int, optional
+        Number of threads used to fault in trixel pages concurrently
+        (default: 1)
+    """
+    def __init__(self, columnar_dir, cache_size=256*2**20, n_threads=1):
+        with open(os.path.join(columnar_dir, "columns.yaml")) as f:
+            meta = yaml.safe_load(f)
+        super().__init__(
+            columnar_dir, level=meta['level'], cache_size=cache_size,
+            n_threads=n_threads
+        )
+        self.mag_sorted = meta.get('sorted_by') == 'i_mag'
+        self.trixels = np.load(os.path.join(columnar_dir, "trixels.npy"))
+        self.offsets = np.load(os.path.join(columnar_dir, "offsets.npy"))
+        self.columns = {}
+        for name, dtype in meta['columns'].items():
+            file = os.path.join(columnar_dir, f"{name}.bin")
+            if meta['nrows'] > 0:
+                self.columns[name] = np.memmap(file, dtype=dtype, mode='r')
+            else:  # np.memmap can't map empty files
+                self.columns[name] = np.empty(0, dtype=dtype)
+
+    def _load_trixel(self, idx):
+        """Get views of the GAIA stars in a single HTM trixel.
+
+        Parameters
+        ----------
+        idx : int
+            HTM trixel index
+
+        Returns
+        -------
+        astropy.table.Table
+            Same columns as GaiaStarCatalog._load_trixel.  Empty if the trixel
+            isn't in the catalog.
+        """
+        i = np.searchsorted(self.trixels, idx)
+        if i < len(self.trixels) and self.trixels[i] == idx:
+            start, end = self.offsets[i], self.offsets[i+1]
+        else:
+            start, end = 0, 0
+        return Table(
+            {name: column[start:end] for name, column in self.columns.items()},
+            copy=False
+        )
+
+    def _brighter_than(self, table, mag_limit):
+        """Select stars with i_mag <= mag_limit from a trixel table.
+
+        Trixels are sorted by magnitude, so this is a prefix of the table and
+        the rows of fainter stars are never read.
+
+        Parameters
+        ----------
+        table : astropy.table.Table
+            Output of `_load_trixel`
+        mag_limit : float
+            Faintest i_mag to include
+
+        Returns
+        -------
+        astropy.table.Table
+        """
+        if not self.mag_sorted:
+            return super()._brighter_than(table, mag_limit)
+        n = np.searchsorted(table['i_mag'], mag_limit, side='right')
+        return table[:n]
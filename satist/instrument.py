@@ -2,9 +2,15 @@
 Telescope and detector instrument models for satellite observation simulations.
 """
 
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import galsim
 import numpy as np
 
+from .tracker import transform_wcs
 from .wcs import radialWCS
 
 
@@ -37,6 +43,10 @@ class Instrument:
                 Field angle in degrees
             'unvig' : array
                 Surviving fraction of photons
+    cache_dir : str, optional
+        Directory in which to cache the pixel area and vignetting maps between
+        runs.  Files are keyed by a hash of the configuration they depend on.
+        If None (default), the maps are only kept in memory.
     """
     def __init__(
         self,
@@ -48,7 +58,8 @@ class Instrument:
         aperture,
         obscuration=0.0,
         distortion=None,
-        vignetting=None
+        vignetting=None,
+        cache_dir=None
     ):
         self.image_shape = image_shape
         self.gain = gain
@@ -58,6 +69,7 @@ class Instrument:
         self.obscuration = obscuration
         self.distortion = distortion
         self.vignetting = vignetting
+        self.cache_dir = cache_dir
 
         if vignetting is not None:
             from scipy.interpolate import interp1d
@@ -84,6 +96,7 @@ class Instrument:
                 - obscuration : float (default: 0.0)
                 - distortion : dict
                 - vignetting : dict
+                - cache_dir : str
                 
         Returns
         -------
@@ -98,7 +111,8 @@ class Instrument:
             aperture = config['aperture'],
             obscuration = config.get('obscuration', 0.0),
             distortion = config.get('distortion', None),
-            vignetting = config.get('vignetting', None)
+            vignetting = config.get('vignetting', None),
+            cache_dir = config.get('cache_dir', None)
         )
 
     def init_image(self, *, sky_phot, exptime):
@@ -116,17 +130,125 @@ class Instrument:
         image : galsim.Image
             Image with sky background added
         """
+        image = galsim.Image(self.image_bounds)
+        # Sky background
+        np.multiply(self.pixel_area_map, sky_phot*exptime, out=image.array)
+        return image
+
+    @galsim.utilities.lazy_property
+    def image_bounds(self):
+        """Bounds of the images, centered on the boresight.
+
+        Returns
+        -------
+        galsim.BoundsI
+        """
         nx, ny = self.image_shape
-        bounds = galsim.BoundsI(-nx//2, nx//2-1, -ny//2, ny//2-1)
-        image = galsim.Image(bounds)
-        # Get a mock wcs by asserting arbitrary boresight, rotation.  Only
-        # actually care about relative pixel sizes here.
+        return galsim.BoundsI(-nx//2, nx//2-1, -ny//2, ny//2-1)
+
+    @galsim.utilities.lazy_property
+    def pixel_area_map(self):
+        """Solid angle of every pixel of an image.
+
+        Returns
+        -------
+        area : float32 array of shape (ny, nx)
+            Pixel areas in arcsec^2
+        """
+        def compute():
+            # Get a mock wcs by asserting arbitrary boresight, rotation.  Only
+            # actually care about relative pixel sizes here.
+            boresight = galsim.CelestialCoord(
+                0*galsim.degrees, 0*galsim.degrees
+            )
+            mock_wcs = self.get_wcs(boresight, 0*galsim.degrees)
+            image = galsim.ImageD(self.image_bounds)
+            mock_wcs.makeSkyImage(image, 1.0)
+            return image.array
+        return self._cached_map('pixel_area', compute)
+
+    @galsim.utilities.lazy_property
+    def vignetting_map(self):
+        """Surviving fraction of photons in every pixel of an image.
+
+        Returns
+        -------
+        unvig : float32 array of shape (ny, nx)
+        """
+        return self._cached_map(
+            'vignetting', lambda: self._vignetting(self.image_bounds)
+        )
+
+    def _vignetting(self, bounds):
+        """Evaluate the vignetting function over pixels within bounds."""
+        # Should really use wcs here to use angular distances, but for now we'll
+        # cheat and just use pixel distances.
         boresight = galsim.CelestialCoord(0*galsim.degrees, 0*galsim.degrees)
         rot_sky_pos = 0*galsim.degrees
         mock_wcs = self.get_wcs(boresight, rot_sky_pos)
-        # Sky background
-        mock_wcs.makeSkyImage(image, sky_phot*exptime)
-        return image
+        xx, yy = galsim.Image(bounds).get_pixel_centers()
+        rr = np.hypot(xx, yy)  # dist from center in pixels
+        rr *= np.sqrt(mock_wcs.pixelArea(galsim.PositionD(0, 0)))  # -> arcsec
+        return self.vigfun(rr/3600)
+
+    def _cached_map(self, name, compute):
+        """Compute a float32 map, or load it from `cache_dir`.
+
+        Parameters
+        ----------
+        name : str
+            Name of the map, used in the cache file name
+        compute : callable
+            Computes the map if it isn't cached
+
+        Returns
+        -------
+        array : float32 array
+        """
+        if self.cache_dir is None:
+            return compute().astype(np.float32)
+        filename = os.path.join(
+            self.cache_dir, f"{name}_{self._config_hash}.npy"
+        )
+        if os.path.exists(filename):
+            return np.load(filename)
+        array = compute().astype(np.float32)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Write atomically, since parallel workers may race to fill the cache
+        tmp = f"{filename}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp, filename)
+        return array
+
+    @galsim.utilities.lazy_property
+    def _config_hash(self):
+        """Hash of the configuration that the cached maps depend on."""
+        def tolist(model):
+            if model is None:
+                return None
+            return {k: np.asarray(v).tolist() for k, v in model.items()}
+        config = dict(
+            image_shape=list(self.image_shape),
+            pixel_scale=self.pixel_scale,
+            distortion=tolist(self.distortion),
+            vignetting=tolist(self.vignetting)
+        )
+        return hashlib.sha256(
+            json.dumps(config, sort_keys=True).encode()
+        ).hexdigest()[:16]
+
+    def precompute(self):
+        """Evaluate the lazily computed WCS fit and maps now.
+
+        Call this before sending the instrument to worker processes, so that
+        they receive the results instead of each computing them again.
+        """
+        self._fiducial_wcs
+        self.pixel_area_map
+        self.vignetting_map
+        self.field_radius
+        self.pix_size
 
     @galsim.utilities.lazy_property
     def field_radius(self):
@@ -148,25 +270,21 @@ class Instrument:
         """Apply vignetting correction to an image.
         
         Modifies the image in-place by multiplying each pixel by the vignetting
-        function based on radial distance from the center.
-        
+        function based on radial distance from the center.  Images from
+        `init_image` use the precomputed `vignetting_map`.
+
         Parameters
         ----------
         image : galsim.Image
             Image to apply vignetting to (modified in-place)
         """
-        # Vignette the background
-        # Should really use wcs here to use angular distances, but for now we'll
-        # cheat and just use pixel distances.
-        boresight = galsim.CelestialCoord(0*galsim.degrees, 0*galsim.degrees)
-        rot_sky_pos = 0*galsim.degrees
-        mock_wcs = self.get_wcs(boresight, rot_sky_pos)
-        xx, yy = image.get_pixel_centers()
-        rr = np.hypot(xx, yy)  # dist from center in pixels
-        rr *= np.sqrt(mock_wcs.pixelArea(galsim.PositionD(0, 0)))  # -> arcsec
-        image.array[:] *= self.vigfun(rr/3600)
+        if image.bounds == self.image_bounds:
+            image.array[:] *= self.vignetting_map
+        else:
+            image.array[:] *= self._vignetting(image.bounds)
 
-    def apply_noise(self, image, sky_phot, rng):
+    def apply_noise(self, image, sky_phot, rng, *, engine='galsim',
+                    n_threads=1):
         """Add CCD noise (Poisson, read noise) to an image.
         
         Parameters
@@ -177,15 +295,27 @@ class Instrument:
             Sky level in photons / arcsec^2 / sec
         rng : numpy.random.Generator
             Random number generator for noise generation
+        engine : {'galsim', 'numpy'}, optional
+            'galsim' (default) applies galsim.CCDNoise.  'numpy' applies the
+            same model with `add_ccd_noise`, which can use several threads.
+            Both draw one seed from `rng`, but give different noise.
+        n_threads : int, optional
+            Threads used by the 'numpy' engine (default: 1).  The noise
+            doesn't depend on it.
         """
-        gsrng = galsim.BaseDeviate(rng.bit_generator.random_raw() % (2**63))
-        noise = galsim.CCDNoise(
-            gsrng,
+        seed = rng.bit_generator.random_raw()
+        kwargs = dict(
             sky_level=sky_phot*self.pix_size**2,
             gain=self.gain,
             read_noise=self.read_noise
         )
-        image.addNoise(noise)
+        if engine == 'galsim':
+            noise = galsim.CCDNoise(galsim.BaseDeviate(seed % (2**63)), **kwargs)
+            image.addNoise(noise)
+        elif engine == 'numpy':
+            add_ccd_noise(image.array, seed=seed, n_threads=n_threads, **kwargs)
+        else:
+            raise ValueError(f"Unknown noise engine: {engine}")
 
     def get_wcs(self, boresight, rot_sky_pos):
         """Create a WCS object for the instrument.
@@ -202,11 +332,23 @@ class Instrument:
         wcs : galsim.GSFitsWCS
             World coordinate system transformation
         """
+        # The distortion only depends on the instrument, so fit it once and
+        # then just recenter and rotate it.
+        return transform_wcs(self._fiducial_wcs, boresight, rot_sky_pos)
+
+    @galsim.utilities.lazy_property
+    def _fiducial_wcs(self):
+        """Distortion WCS fit at boresight (0, 0) and zero rotation.
+
+        Returns
+        -------
+        wcs : galsim.GSFitsWCS
+        """
         return radialWCS(
             self.distortion['th'],
             np.array(self.distortion['dthdr'])*self.pixel_scale,
-            boresight,
-            rot_sky_pos,
+            galsim.CelestialCoord(0*galsim.degrees, 0*galsim.degrees),
+            0*galsim.degrees,
             n=8, order=3
         )
 
@@ -256,6 +398,28 @@ class Instrument:
         #     zp = log10(ZP)/0.4 + 24
         return  np.log10(ZP)/0.4 + 24
 
+    def streak_area(self, *, length, psf_fwhm):
+        """Calculate the effective area of a streak.
+
+        The effective area is a rectangle along the streak plus two
+        semi-circular endcaps, each of the size of the PSF.
+
+        Parameters
+        ----------
+        length : float
+            Streak length in arcseconds
+        psf_fwhm : float
+            PSF full-width at half-maximum in arcseconds
+
+        Returns
+        -------
+        aeff : float
+            Effective area in pixels
+        """
+        neff = 2.266 * (psf_fwhm / self.pix_size)**2
+        reff = np.sqrt(neff/np.pi)
+        return neff+reff*length
+
     def streak_snr(self, *, nphot, length, psf_fwhm, sky_phot):
         """Calculate signal-to-noise ratio for a streak.
         
@@ -278,10 +442,92 @@ class Instrument:
         snr : array_like
             Signal-to-noise ratio for each streak
         """
-        neff = 2.266 * (psf_fwhm / self.pix_size)**2
-        reff = np.sqrt(neff/np.pi)
-        # effective area is rectangle + 2 semi-circular endcaps
-        aeff = neff+reff*length
+        aeff = self.streak_area(length=length, psf_fwhm=psf_fwhm)
         var = nphot/self.gain
         var += (sky_phot*self.pix_size**2/self.gain + self.read_noise**2)*aeff
-        return nphot / np.sqrt(var)
\ No newline at end of file
+        return nphot / np.sqrt(var)
+
+    def limiting_nphot(self, *, snr, length, psf_fwhm, sky_phot):
+        """Calculate the number of photons for which a streak reaches an SNR.
+
+        Inverse of `streak_snr` with respect to nphot.
+
+        Parameters
+        ----------
+        snr : float
+            Signal-to-noise ratio
+        length : float
+            Streak length in arcseconds
+        psf_fwhm : float
+            PSF full-width at half-maximum in arcseconds
+        sky_phot : float
+            Sky level in photons / arcsec^2 / sec
+
+        Returns
+        -------
+        nphot : float
+            Number of photons in a streak with the given SNR
+        """
+        aeff = self.streak_area(length=length, psf_fwhm=psf_fwhm)
+        bkg = (sky_phot*self.pix_size**2/self.gain + self.read_noise**2)*aeff
+        # Solve nphot**2 = snr**2 * (nphot/gain + bkg)
+        a = snr**2/self.gain
+        return 0.5*(a + np.sqrt(a**2 + 4*snr**2*bkg))
+
+
+def add_ccd_noise(array, *, sky_level, gain, read_noise, seed, n_threads=1,
+                  block_rows=64):
+    """Add CCD noise (Poisson, read noise) to an array in place.
+
+    Follows the noise model of galsim.CCDNoise: the Poisson noise of the
+    array plus `sky_level` in electrons, and Gaussian read noise, in ADU.
+    The array is processed in blocks of rows, each with its own random
+    stream spawned from `seed`, so the blocks can be drawn concurrently and
+    the noise is the same for any number of threads.
+
+    Parameters
+    ----------
+    array : array of shape (ny, nx)
+        Image in ADU to add noise to (modified in-place)
+    sky_level : float
+        Sky level in ADU per pixel that has already been subtracted from the
+        array, but contributes to its Poisson noise
+    gain : float
+        Electrons per ADU.  If <= 0, no Poisson noise is added and
+        `read_noise` is in ADU.
+    read_noise : float
+        Read noise in electrons
+    seed : int or numpy.random.SeedSequence
+        Seed of the block streams
+    n_threads : int, optional
+        Number of threads drawing blocks (default: 1)
+    block_rows : int, optional
+        Number of rows per block (default: 64)
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    starts = range(0, array.shape[0], block_rows)
+    seeds = seed.spawn(len(starts))
+    sigma = read_noise/gain if gain > 0 else read_noise
+
+    def add_block(start, block_seed):
+        rng = np.random.default_rng(block_seed)
+        block = array[start:start+block_rows]
+        noisy = block.astype(float)
+        if gain > 0:
+            noisy += sky_level
+            noisy *= gain  # convert to electrons
+            noisy = rng.poisson(noisy.clip(0.))/gain
+            noisy -= sky_level
+        if sigma > 0:
+            noisy += rng.normal(scale=sigma, size=noisy.shape)
+        block[:] = noisy
+
+    if n_threads > 1 and len(starts) > 1:
+        with ThreadPoolExecutor(
+            max_workers=min(n_threads, len(starts))
+        ) as executor:
+            list(executor.map(add_block, starts, seeds))
+    else:
+        for start, block_seed in zip(starts, seeds):
+            add_block(start, block_seed)
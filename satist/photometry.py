@@ -5,11 +5,21 @@ See: https://gea.esac.esa.int/archive/documentation/GDR2/Data_processing/chap_cu
 """
 
 #import spextre
+import functools
+import os
+
 from astroquery.gaia import Gaia
 import astropy.units as u
 from astropy.coordinates import SkyCoord
 import numpy as np 
 
+# Precomputed output of get_gaia_magnitude_histogram, shipped with the package
+# so mock catalogs can be built without network access.  Regenerate with
+# scripts/make_gaia_magnitude_histogram.py.
+GAIA_MAGNITUDE_HISTOGRAM_FILE = os.path.join(
+    os.path.dirname(__file__), "data", "gaia_magnitude_histogram.npz"
+)
+
 def convert_gaia_magnitude(gaia_g, gaia_bp, gaia_rp, target_filter='2MASS_Ks'):
     """
     Photometric transforms from the Gaia Data Release 2 data G, G_BP, G_RP into a target
@@ -96,6 +106,76 @@ def get_gaia_magnitude_histogram(gaia_data_release=3, star_lim=-1, nbins=100):
     return results 
 
 
+def save_gaia_magnitude_histogram(results, filename=GAIA_MAGNITUDE_HISTOGRAM_FILE):
+    """
+    Save magnitude histograms to a .npz file.
+
+    Args:
+        results (dict): Output of get_gaia_magnitude_histogram.
+        filename (str): File to write, by default the one bundled with the
+        package.
+    """
+    arrays = {}
+    for filter, hist in results.items():
+        arrays[f'{filter}_bins'] = hist['bins']
+        arrays[f'{filter}_values'] = hist['values']
+    dirname = os.path.dirname(filename)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    np.savez(filename, **arrays)
+
+
+def read_gaia_magnitude_histogram(filename):
+    """
+    Read magnitude histograms written by save_gaia_magnitude_histogram.
+
+    Args:
+        filename (str): File to read.
+    Returns:
+        results (dict): Same structure as get_gaia_magnitude_histogram.
+    """
+    results = {}
+    with np.load(filename) as data:
+        for key in data.files:
+            filter, field = key.rsplit('_', 1)
+            results.setdefault(filter, {})[field] = data[key]
+    return results
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_gaia_magnitude_histogram(filename):
+    if filename is None:
+        return get_gaia_magnitude_histogram()
+    return read_gaia_magnitude_histogram(filename)
+
+
+def load_gaia_magnitude_histogram(allow_query=False):
+    """
+    Get the Gaia G, BP and RP magnitude histograms without a network query.
+
+    Reads the histograms bundled with the package, once per process.
+
+    Args:
+        allow_query (bool): If the bundled file is missing, query the Gaia
+        archive with get_gaia_magnitude_histogram instead of raising.
+    Returns:
+        results (dict): Same structure as get_gaia_magnitude_histogram. The
+        arrays are shared between callers, so don't modify them in place.
+    Raises:
+        FileNotFoundError: If the bundled file is missing and allow_query is
+        False.
+    """
+    if os.path.exists(GAIA_MAGNITUDE_HISTOGRAM_FILE):
+        return _cached_gaia_magnitude_histogram(GAIA_MAGNITUDE_HISTOGRAM_FILE)
+    if not allow_query:
+        raise FileNotFoundError(
+            f"{GAIA_MAGNITUDE_HISTOGRAM_FILE} not found.  Run "
+            "scripts/make_gaia_magnitude_histogram.py to create it, or allow "
+            "querying the Gaia archive instead."
+        )
+    return _cached_gaia_magnitude_histogram(None)
+
+
 def vega_to_ab_offset(filter_name):
     """
     Vega to AB magnitude system offset terms.
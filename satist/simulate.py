@@ -2,7 +2,9 @@
 Generate synthetic telescope observations with stars and satellites.
 """
 
+import functools
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 import astroplan
 import astropy.io.fits as fits
@@ -19,6 +21,65 @@ import random
 import satist as xfiles
 
 
+# Star catalogs cache the trixels they read, so keep one catalog per catalog
+# config for the lifetime of the process and reuse it across observations.
+_catalogs = {}
+
+
+def get_catalog(catalog_config):
+    """Get the star catalog for a catalog config, reusing it within a process.
+
+    Parameters
+    ----------
+    catalog_config : dict
+        Catalog configuration with fields:
+            - develop : bool (optional)
+                Use mock catalog if True
+            - gaia_mags : bool (optional)
+                Add mock Gaia G, BP and RP magnitudes to the mock catalog,
+                sampled from the bundled magnitude histograms
+                (default: False)
+            - allow_gaia_query : bool (optional)
+                Let the mock catalog query the Gaia archive if its bundled
+                magnitude histograms are missing (default: False)
+            - gaia_dir : str
+                Directory of GAIA data
+            - gaia_format : {'fits', 'columnar'} (optional)
+                Layout of gaia_dir: per-trixel FITS files (default), or the
+                columnar layout written by catalog.convert_gaia_shards
+            - cache_mb : float (optional)
+                Memory in MiB used to cache trixels (default: 256)
+            - n_threads : int (optional)
+                Threads used to load the trixels of a query (default: 1)
+
+    Returns
+    -------
+    catalog : StarCatalog
+    """
+    key = yaml.safe_dump(catalog_config, sort_keys=True)
+    if key not in _catalogs:
+        cache_size = int(catalog_config.get('cache_mb', 256) * 2**20)
+        n_threads = catalog_config.get('n_threads', 1)
+        if catalog_config.get("develop", False):
+            catalog = xfiles.MockStarCatalog(
+                cache_size=cache_size, n_threads=n_threads,
+                gaia_mags=catalog_config.get("gaia_mags", False),
+                allow_query=catalog_config.get("allow_gaia_query", False)
+            )
+        elif catalog_config.get("gaia_format", "fits") == "columnar":
+            catalog = xfiles.ColumnarGaiaStarCatalog(
+                catalog_config['gaia_dir'], cache_size=cache_size,
+                n_threads=n_threads
+            )
+        else:
+            catalog = xfiles.GaiaStarCatalog(
+                catalog_config['gaia_dir'], cache_size=cache_size,
+                n_threads=n_threads
+            )
+        _catalogs[key] = catalog
+    return _catalogs[key]
+
+
 def make_image(config, rng, parameters):
     """Generate a single simulated telescope image with stars and satellites.
     
@@ -36,10 +97,63 @@ def make_image(config, rng, parameters):
                 Catalog configuration with fields:
                     - develop : bool (optional)
                         Use mock catalog if True
+                    - gaia_mags : bool (optional)
+                        Add mock Gaia G, BP and RP magnitudes to the mock
+                        catalog
+                    - allow_gaia_query : bool (optional)
+                        Let the mock catalog query the Gaia archive if its
+                        bundled magnitude histograms are missing
                     - gaia_dir : str
                         Directory of GAIA data
+                    - gaia_format : str (optional)
+                        'fits' (default) or 'columnar'
                     - min_snr : float
                         Minimum SNR for stars to include
+                    - cache_mb : float (optional)
+                        Memory in MiB used to cache trixels across images
+                    - n_threads : int (optional)
+                        Threads used to load the trixels of a query
+            - render : dict (optional)
+                Rendering configuration with fields:
+                    - method : str (optional)
+                        Star drawing method passed to tools.draw_stars,
+                        'auto' (default), 'phot', 'batch', 'stamp' or 'fft'
+                    - fft_threshold : int (optional)
+                        Number of stars from which method 'auto' draws with
+                        FFTs (default: 5000)
+                    - max_error : float (optional)
+                        Maximum pixel deviation of the straight segments
+                        trails are drawn with from the curved trails.  If
+                        given, each star and satellite gets as many
+                        segments as needed (default: fixed number)
+                    - max_nsplit : int (optional)
+                        Maximum number of segments per trail if max_error is
+                        given; trails that need more warn (default: 64)
+                    - phot_threshold : float (optional)
+                        Expected photons of a trail segment above which it
+                        is drawn analytically with Poisson noise instead of
+                        by photon shooting (default: shoot all)
+                    - photon_budget : float (optional)
+                        Maximum expected photons shot per image; the
+                        brightest segments beyond it are drawn analytically
+                        (default: no limit).  Either way, segments are only
+                        drawn analytically where that is cheaper than
+                        shooting them, see tools.PhotonBudget
+                    - fold_threshold : float (optional)
+                        Mean photons per pixel of a star's streak below
+                        which it is folded into a smooth background instead
+                        of being drawn; the truth table flags the stars that
+                        were drawn in column 'rendered' (default: draw all)
+                    - background_cell : int (optional)
+                        Size in pixels of the background cells folded stars
+                        are spread over (default: 64)
+                    - noise_engine : str (optional)
+                        CCD noise engine passed to
+                        Instrument.apply_noise, 'galsim' (default) or
+                        'numpy'
+                    - noise_threads : int (optional)
+                        Threads used by the 'numpy' noise engine
+                        (default: 1)
             - sat : dict
                 Satellite configuration
             - tracker : dict
@@ -96,6 +210,11 @@ def make_image(config, rng, parameters):
     # Setup tracking
     ####################################################################
 
+    # Rendering queries the boresight many times during the exposure.  The
+    # tracker only interpolates the boresight if that meets its tolerance.
+    window_error = tracker.fit_window(t0, t0+exptime*u.s)
+    print(f"{window_error = }")
+
     # Because we're using an imperfect tracker, our boresight at t=t0 is
     # no longer at boresight0.  Let's fix this.
     boresight0 = tracker.get_boresight(t0)
@@ -118,17 +237,26 @@ def make_image(config, rng, parameters):
     # Get star catalog and trim faint sources
     ####################################################################
 
-    if config['catalog'].get("develop", False):
-        catalog = xfiles.MockStarCatalog()
-    else:
-        catalog = xfiles.GaiaStarCatalog(config['catalog']['gaia_dir'])
+    catalog = get_catalog(config['catalog'])
     cushion = 0.05 * galsim.degrees
     radius = instrument.field_radius + cushion
     p0 = tracker.get_boresight(t0)
     p1 = tracker.get_boresight(t0+exptime*u.s)
-    stars = catalog.get_stars(p0, p1, radius, t0)
-    stars['nphot'] = 10**(-0.4*(stars['i_mag'] - zp)) * exptime
     length = p0.distanceTo(p1) / galsim.arcsec / instrument.pix_size
+    # Let the catalog skip stars that can't pass the SNR cut below.  Add a
+    # little slack so roundoff can't drop stars right at the limit.
+    nphot_limit = instrument.limiting_nphot(
+        snr=config['catalog']['min_snr'],
+        length=length,
+        psf_fwhm=psf_fwhm,
+        sky_phot=sky_phot
+    )
+    mag_limit = zp - 2.5*np.log10(nphot_limit/exptime) + 0.01
+    print(f"{mag_limit = }")
+    stars = catalog.get_stars(p0, p1, radius, t0, mag_limit=mag_limit)
+    print(f"{catalog.cache.hits = }")
+    print(f"{catalog.cache.misses = }")
+    stars['nphot'] = 10**(-0.4*(stars['i_mag'] - zp)) * exptime
     stars['SNR'] = instrument.streak_snr(
         nphot=stars['nphot'],
         length=length,
@@ -137,6 +265,14 @@ def make_image(config, rng, parameters):
     )
     stars = stars[stars['SNR'] > config['catalog']['min_snr']]
     print(f"{len(stars) = }")
+    # Stars adding less than fold_threshold photons to the pixels of their
+    # streak are folded into a smooth background instead of being drawn.
+    fold_threshold = config.get('render', {}).get('fold_threshold', None)
+    stars['rendered'] = np.ones(len(stars), dtype=bool)
+    if fold_threshold is not None:
+        aeff = instrument.streak_area(length=length, psf_fwhm=psf_fwhm)
+        stars['rendered'] = stars['nphot']/aeff >= fold_threshold
+        print(f"{np.count_nonzero(~stars['rendered']) = }")
 
     ####################################################################
     # Generate a mag/nphot for satellite
@@ -155,13 +291,36 @@ def make_image(config, rng, parameters):
     # Run the simulation!
     ####################################################################
 
+    # Photon shooting gets its own stream spawned from the observation seed,
+    # so rendering is reproducible without perturbing the draws from rng.
+    draw_rng = np.random.default_rng(rng.bit_generator.seed_seq.spawn(1)[0])
+    render_config = config.get('render', {})
+    method = render_config.get('method', 'auto')
+    stamp_cache = xfiles.tools.StampCache(psf) if method == 'stamp' else None
+    photon_budget = None
+    phot_threshold = render_config.get('phot_threshold', None)
+    max_photons = render_config.get('photon_budget', None)
+    if phot_threshold is not None or max_photons is not None:
+        photon_budget = xfiles.tools.PhotonBudget(phot_threshold, max_photons)
     image = instrument.init_image(sky_phot=sky_phot, exptime=exptime)
     stars = xfiles.tools.draw_stars(
         stars,
         t0=t0, exptime=exptime,
         wcs0=wcs0, tracker=tracker,
-        psf=psf, image=image
+        psf=psf, image=image,
+        rng=draw_rng,
+        method=method,
+        stamp_cache=stamp_cache,
+        fft_threshold=render_config.get('fft_threshold', 5000),
+        max_error=render_config.get('max_error', None),
+        max_nsplit=render_config.get('max_nsplit', 64),
+        photon_budget=photon_budget,
+        background_cell=render_config.get('background_cell', 64)
     )
+    if stamp_cache is not None:
+        print(f"{stamp_cache.hits = }")
+        print(f"{stamp_cache.misses = }")
+        print(f"{stamp_cache.shot = }")
     sats, wcst = xfiles.tools.draw_sat(
         orbits,
         t0=t0, exptime=exptime,
@@ -169,13 +328,24 @@ def make_image(config, rng, parameters):
         psf=psf, image=image,
         observer=observer,
         nphot=sat_nphots,
-        propagator=propagator
+        propagator=propagator,
+        rng=draw_rng,
+        max_error=render_config.get('max_error', None),
+        max_nsplit=render_config.get('max_nsplit', 64),
+        photon_budget=photon_budget
     )
+    if photon_budget is not None:
+        print(f"{photon_budget.shot = }")
+        print(f"{photon_budget.analytic = }")
 
     # TODO: change here
     sats['i_mag'] = sat_mags
     instrument.apply_vignetting(image)
-    instrument.apply_noise(image, sky_phot, rng)
+    instrument.apply_noise(
+        image, sky_phot, rng,
+        engine=render_config.get('noise_engine', 'galsim'),
+        n_threads=render_config.get('noise_threads', 1)
+    )
 
     ####################################################################
     # Format output sample submission files
@@ -306,6 +476,202 @@ def make_image(config, rng, parameters):
     return hdu, hduTrueWCS, hduTrueWCST, sample_docs, truth_hdulist
 
 
+# Instrument of a worker process, set once by `_init_worker`
+_worker_instrument = None
+
+
+def _init_worker(instrument):
+    """Keep the instrument in a worker process for all its observations."""
+    global _worker_instrument
+    _worker_instrument = instrument
+
+
+def _simulate_worker_observation(config, i_obs):
+    """`_simulate_observation` with the instrument of the worker process."""
+    return _simulate_observation(config, _worker_instrument, i_obs)
+
+
+def _simulate_observation(config, instrument, i_obs):
+    """Simulate a single observation and write out its images.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary; see `simulate`.
+    instrument : Instrument
+        Instrument model shared by all observations.
+    i_obs : int
+        Index of the observation.  The observation is seeded with
+        config['seed'] + i_obs, so it doesn't depend on any other observation.
+
+    Returns
+    -------
+    sample_doc : dict
+        Sample submission for this observation
+    truth_hdulist : list
+        List of FITS HDUs containing true satellite and star catalogs
+    """
+    propagator = ssapy.KeplerianPropagator()
+
+    with xfiles.tools.nostdout():
+        # Use seed + i_obs so we could theoretically start in the middle.
+        rng = np.random.default_rng(config['seed']+i_obs)
+
+        ####################################################################
+        # Setup the observing configuration
+        ####################################################################
+
+        exptime = rng.choice(config['cadence']['exptime'])
+        site = astroplan.Observer.at_site(rng.choice(config['sites']))
+        observer = ssapy.EarthObserver(
+            lon=site.location.lon.to(u.deg).value,
+            lat=site.location.lat.to(u.deg).value,
+            elevation=site.location.height.to(u.m).value
+        )
+        cond_cfg = config['conditions']
+        psf_fwhm = rng.uniform(*cond_cfg['psf_fwhm_range'])
+        sky_sb = rng.uniform(*cond_cfg['sky_range'])
+        zp_offset = rng.uniform(*cond_cfg['zp_range'])
+        zp = instrument.compute_LSST_scaled_zp() + zp_offset
+        print()
+        print(f"{exptime = :.2f} s")
+        print(f"{site.name = }")
+        print(f"{psf_fwhm = :.2f} arcsec")
+        print(f"{sky_sb = :.2f} mag / arcsec^2")
+        print(f"{zp_offset = :.2f} mag")
+        print(f"{zp = :.2f} mag")
+        print(f"{sky_sb = :.2f} mag / arcsec^2")
+
+        ####################################################################
+        # Pick a time when it's night out, pick a direction to point,
+        # and generate a LEO satellite nearby.
+        ####################################################################
+
+        t_day = Time("2010-01-01") + rng.uniform(0, 365)*u.d
+        t0 = xfiles.tools.random_dark_time(t_day=t_day, site=site, rng=rng)
+
+        boresight0 = xfiles.tools.random_boresight(
+            observer=observer, t0=t0, horizon=np.deg2rad(20), rng=rng
+        )
+        sat_height = rng.uniform(400e3, 800e3)
+        sat_coord = xfiles.tools.random_disk(
+            boresight0, 0.2*instrument.field_radius, rng
+        )
+        heading = rng.uniform(0, 2*np.pi)
+        vperp = rng.normal(7800, 10)  # nearly circular LEO
+        vpar = rng.normal(10)
+
+        tmid = t0 + 0.5*exptime*u.s
+        orbit = xfiles.tools.generate_orbit(
+            sat_height, sat_coord, heading, vperp, vpar, observer, tmid
+        )
+
+        if config['sat']['mag_range'] is not None:
+            sat_mag = rng.uniform(*config['sat']['mag_range'])
+        else:
+            sat_mag = None
+
+        if config['n_sat'] == 1:
+            orbits = [orbit]
+            sat_mags = [sat_mag]
+        elif config['n_sat'] == 2:
+            # the current values here are for CSOs (change back to *6 for CSOs)
+            # np.random.beta(9.7*10**-6,2.4*10**-5)*1.45*10**-4)
+            #ra_offset = random.choice((-1, 1)) * np.random.beta(2,5)*6 * 4.84814*10**-6
+            #dec_offset = random.choice((-1, 1)) * np.random.beta(2,5)*6 * 4.84814*10**-6
+            ra_offset = rng.choice((-1, 1)) * psf_fwhm * rng.uniform(.2, 1.5) # (.2, 1.5) 
+            dec_offset = rng.choice((-1, 1)) * psf_fwhm * rng.uniform(.2, 1.5) # (.2, 1.5)
+            print(f"{ra_offset = } arcsec")
+            print(f"{dec_offset = } arcsec")
+            orbit2 = xfiles.tools.generate_orbit(
+            sat_height, galsim.CelestialCoord(
+                ra=(sat_coord.ra.rad+(ra_offset*4.84814*10**-6))*galsim.radians, 
+                dec=(sat_coord.dec.rad+(dec_offset*4.84814*10**-6))*galsim.radians), 
+                heading, vperp, vpar, observer, tmid
+            )
+            # magnitude of satellite 2 should be within 1.5 mags of satellite 1, not going over bounds
+            if sat_mag - 1.5 < config['sat']['mag_range'][0]:
+                mag_bound_1 = -(sat_mag - config['sat']['mag_range'][0])
+            else: 
+                mag_bound_1 = -1.5
+            if sat_mag + 1.5 > config['sat']['mag_range'][1]:
+                mag_bound_2 = config['sat']['mag_range'][1] - sat_mag
+            else: 
+                mag_bound_2 = 1.5
+            
+            mag_offset = rng.uniform(mag_bound_1,mag_bound_2)
+            sat_mag2 = sat_mag + mag_offset
+            print(f"{mag_offset = } mag")
+            orbits = [orbit, orbit2]
+            sat_mags = [sat_mag, sat_mag2]
+        else:
+            print("Not a currently supported number of satellites per image (n_sat)")
+
+        tracker_cfg = config['tracker']
+        tracking_error = tracker_cfg['error']
+        rot_sky_pos0 = config['tracker']['rot_sky_pos0'] * galsim.degrees
+        if tracker_cfg['type'] == 'orbit':
+            t_prev = t0 - tracking_error['t_rewind']*u.min
+            r_prev, v_prev = ssapy.rv(orbit, t_prev, propagator=propagator)
+            v_prev += rng.normal(
+                scale=tracking_error['v_perturb'],
+                size=3
+            )
+            tracking_orbit = ssapy.Orbit(r_prev, v_prev, t_prev)
+            tracker = xfiles.OrbitTracker(
+                orbit=tracking_orbit, observer=observer, t0=t0,
+                rot_sky_pos0=rot_sky_pos0,
+                propagator=propagator
+            )
+        elif tracker_cfg['type'] == 'sidereal':
+            tracking_boresight = xfiles.tools.random_disk(
+                boresight0,
+                instrument.field_radius*tracking_error['boresight'],
+                rng
+            )
+            tracker = xfiles.SiderealTracker(
+                tracking_boresight,
+                rot_sky_pos0
+            )
+
+        parameters = dict(
+            orbit=orbits, observer=observer, t0=t0, instrument=instrument,
+            exptime=exptime, tracker=tracker, sat_mag=sat_mags,
+            sky_sb=sky_sb, psf_fwhm=psf_fwhm, zp=zp, i_obs=i_obs,
+            propagator=propagator)
+
+        hdu, hduTrueWCS, hduTrueWCST, sample_doc, true_hdulist = make_image(
+            config, rng, parameters)
+        hdu.writeto(
+            os.path.join(
+                config['outdir'],
+                "public",
+                f"{i_obs+1:04d}.fits"
+            ),
+            overwrite=True
+        )
+        
+        hduTrueWCS.writeto(
+            os.path.join(
+                config['outdir'],
+                "private",
+                f"{i_obs+1:04d}.wcs.fits"
+            ),
+            overwrite=True
+        )
+
+        hduTrueWCST.writeto(
+            os.path.join(
+                config['outdir'],
+                "private",
+                f"{i_obs+1:04d}.wcst.fits"
+            ),
+            overwrite=True
+        )
+
+    return sample_doc, true_hdulist
+
+
 def simulate(config):
     """Run full simulation to generate synthetic telescope observations.
     
@@ -345,8 +711,13 @@ def simulate(config):
                 Tracker configuration
             - catalog : dict
                 Star catalog configuration
+            - render : dict (optional)
+                Image rendering configuration, see make_image
             - meta : dict
                 Metadata to include in output
+            - n_workers : int (optional)
+                Number of processes rendering observations concurrently
+                (default: 1, render serially)
     
     Notes
     -----
@@ -373,172 +744,41 @@ def simulate(config):
     sample_docs = [config['meta']]
     truth_demo_hdul = fits.HDUList()
     truth_hdul = fits.HDUList()
-    propagator = ssapy.KeplerianPropagator()
 
-    for i_obs in tqdm(range(config['n_obs'])):
-        with xfiles.tools.nostdout():
-            # Use seed + i_obs so we could theoretically start in the middle.
-            rng = np.random.default_rng(config['seed']+i_obs)
-
-            ####################################################################
-            # Setup the observing configuration
-            ####################################################################
-
-            exptime = rng.choice(config['cadence']['exptime'])
-            site = astroplan.Observer.at_site(rng.choice(config['sites']))
-            observer = ssapy.EarthObserver(
-                lon=site.location.lon.to(u.deg).value,
-                lat=site.location.lat.to(u.deg).value,
-                elevation=site.location.height.to(u.m).value
-            )
-            cond_cfg = config['conditions']
-            psf_fwhm = rng.uniform(*cond_cfg['psf_fwhm_range'])
-            sky_sb = rng.uniform(*cond_cfg['sky_range'])
-            zp_offset = rng.uniform(*cond_cfg['zp_range'])
-            zp = instrument.compute_LSST_scaled_zp() + zp_offset
-            print()
-            print(f"{exptime = :.2f} s")
-            print(f"{site.name = }")
-            print(f"{psf_fwhm = :.2f} arcsec")
-            print(f"{sky_sb = :.2f} mag / arcsec^2")
-            print(f"{zp_offset = :.2f} mag")
-            print(f"{zp = :.2f} mag")
-            print(f"{sky_sb = :.2f} mag / arcsec^2")
-
-            ####################################################################
-            # Pick a time when it's night out, pick a direction to point,
-            # and generate a LEO satellite nearby.
-            ####################################################################
-
-            t_day = Time("2010-01-01") + rng.uniform(0, 365)*u.d
-            t0 = xfiles.tools.random_dark_time(t_day=t_day, site=site, rng=rng)
-
-            boresight0 = xfiles.tools.random_boresight(
-                observer=observer, t0=t0, horizon=np.deg2rad(20), rng=rng
-            )
-            sat_height = rng.uniform(400e3, 800e3)
-            sat_coord = xfiles.tools.random_disk(
-                boresight0, 0.2*instrument.field_radius, rng
-            )
-            heading = rng.uniform(0, 2*np.pi)
-            vperp = rng.normal(7800, 10)  # nearly circular LEO
-            vpar = rng.normal(10)
+    # Each observation is seeded independently, so they can be rendered in any
+    # order.  `map` yields results in i_obs order in either case, so the
+    # gathered truth catalogs and sample submissions don't depend on
+    # n_workers.
+    n_obs = config['n_obs']
+    n_workers = config.get('n_workers', 1)
+    if n_workers > 1:
+        # Compute the instrument's maps once here and hand the instrument to
+        # each worker once, rather than pickling it with every observation.
+        instrument.precompute()
+        with ProcessPoolExecutor(
+            max_workers=n_workers, initializer=_init_worker,
+            initargs=(instrument,)
+        ) as executor:
+            results = list(tqdm(
+                executor.map(
+                    functools.partial(_simulate_worker_observation, config),
+                    range(n_obs)
+                ),
+                total=n_obs
+            ))
+    else:
+        worker = functools.partial(_simulate_observation, config, instrument)
+        results = map(worker, tqdm(range(n_obs)))
 
-            tmid = t0 + 0.5*exptime*u.s
-            orbit = xfiles.tools.generate_orbit(
-                sat_height, sat_coord, heading, vperp, vpar, observer, tmid
-            )
+    for i_obs, (sample_doc, true_hdulist) in enumerate(results):
+        truth_hdul.append(true_hdulist[0])
+        truth_hdul.append(true_hdulist[1])
+        if i_obs <= (config['n_demo']-1):
+            truth_demo_hdul.append(true_hdulist[0])
+            truth_demo_hdul.append(true_hdulist[1])
 
-            if config['sat']['mag_range'] is not None:
-                sat_mag = rng.uniform(*config['sat']['mag_range'])
-            else:
-                sat_mag = None
-
-            if config['n_sat'] == 1:
-                orbits = [orbit]
-                sat_mags = [sat_mag]
-            elif config['n_sat'] == 2:
-                # the current values here are for CSOs (change back to *6 for CSOs)
-                # np.random.beta(9.7*10**-6,2.4*10**-5)*1.45*10**-4)
-                #ra_offset = random.choice((-1, 1)) * np.random.beta(2,5)*6 * 4.84814*10**-6
-                #dec_offset = random.choice((-1, 1)) * np.random.beta(2,5)*6 * 4.84814*10**-6
-                ra_offset = random.choice((-1, 1)) * psf_fwhm * random.uniform(.2, 1.5) # (.2, 1.5) 
-                dec_offset = random.choice((-1, 1)) * psf_fwhm * random.uniform(.2, 1.5) # (.2, 1.5)
-                print(f"{ra_offset = } arcsec")
-                print(f"{dec_offset = } arcsec")
-                orbit2 = xfiles.tools.generate_orbit(
-                sat_height, galsim.CelestialCoord(
-                    ra=(sat_coord.ra.rad+(ra_offset*4.84814*10**-6))*galsim.radians, 
-                    dec=(sat_coord.dec.rad+(dec_offset*4.84814*10**-6))*galsim.radians), 
-                    heading, vperp, vpar, observer, tmid
-                )
-                # magnitude of satellite 2 should be within 1.5 mags of satellite 1, not going over bounds
-                if sat_mag - 1.5 < config['sat']['mag_range'][0]:
-                    mag_bound_1 = -(sat_mag - config['sat']['mag_range'][0])
-                else: 
-                    mag_bound_1 = -1.5
-                if sat_mag + 1.5 > config['sat']['mag_range'][1]:
-                    mag_bound_2 = config['sat']['mag_range'][1] - sat_mag
-                else: 
-                    mag_bound_2 = 1.5
-                
-                mag_offset = random.uniform(mag_bound_1,mag_bound_2)
-                sat_mag2 = sat_mag + mag_offset
-                print(f"{mag_offset = } mag")
-                orbits = [orbit, orbit2]
-                sat_mags = [sat_mag, sat_mag2]
-            else:
-                print("Not a currently supported number of satellites per image (n_sat)")
-
-            tracker_cfg = config['tracker']
-            tracking_error = tracker_cfg['error']
-            rot_sky_pos0 = config['tracker']['rot_sky_pos0'] * galsim.degrees
-            if tracker_cfg['type'] == 'orbit':
-                t_prev = t0 - tracking_error['t_rewind']*u.min
-                r_prev, v_prev = ssapy.rv(orbit, t_prev, propagator=propagator)
-                v_prev += rng.normal(
-                    scale=tracking_error['v_perturb'],
-                    size=3
-                )
-                tracking_orbit = ssapy.Orbit(r_prev, v_prev, t_prev)
-                tracker = xfiles.OrbitTracker(
-                    orbit=tracking_orbit, observer=observer, t0=t0,
-                    rot_sky_pos0=rot_sky_pos0,
-                    propagator=propagator
-                )
-            elif tracker_cfg['type'] == 'sidereal':
-                tracking_boresight = xfiles.tools.random_disk(
-                    boresight0,
-                    instrument.field_radius*tracking_error['boresight'],
-                    rng
-                )
-                tracker = xfiles.SiderealTracker(
-                    tracking_boresight,
-                    rot_sky_pos0
-                )
-
-            parameters = dict(
-                orbit=orbits, observer=observer, t0=t0, instrument=instrument,
-                exptime=exptime, tracker=tracker, sat_mag=sat_mags,
-                sky_sb=sky_sb, psf_fwhm=psf_fwhm, zp=zp, i_obs=i_obs,
-                propagator=propagator)
-
-            hdu, hduTrueWCS, hduTrueWCST, sample_doc, true_hdulist = make_image(
-                config, rng, parameters)
-            truth_hdul.append(true_hdulist[0])
-            truth_hdul.append(true_hdulist[1])
-            if i_obs <= (config['n_demo']-1):
-                truth_demo_hdul.append(true_hdulist[0])
-                truth_demo_hdul.append(true_hdulist[1])
-
-            sample_docs.append(sample_doc)
-
-            hdu.writeto(
-                os.path.join(
-                    config['outdir'],
-                    "public",
-                    f"{i_obs+1:04d}.fits"
-                ),
-                overwrite=True
-            )
-            
-            hduTrueWCS.writeto(
-                os.path.join(
-                    config['outdir'],
-                    "private",
-                    f"{i_obs+1:04d}.wcs.fits"
-                ),
-                overwrite=True
-            )
+        sample_docs.append(sample_doc)
 
-            hduTrueWCST.writeto(
-                os.path.join(
-                    config['outdir'],
-                    "private",
-                    f"{i_obs+1:04d}.wcst.fits"
-                ),
-                overwrite=True
-            )
 
     # Write out complete set of sample submissions privately
     with open(
@@ -7,6 +7,8 @@ from abc import ABC, abstractmethod
 import galsim
 import numpy as np
 import ssapy
+from astropy.time import Time
+from numpy.polynomial.chebyshev import chebfit, chebpts1, chebval
 
 
 class Tracker(ABC):
@@ -15,6 +17,15 @@ class Tracker(ABC):
     Defines the interface for tracking systems that determine telescope
     pointing direction and camera orientation as a function of time.
     """
+
+    @property
+    def is_stationary(self):
+        """Whether the boresight and camera rotation are fixed on the sky.
+
+        If True, stars don't move during exposures.  Subclasses that can be
+        stationary should override this.
+        """
+        return False
     
     @abstractmethod
     def get_boresight(self, time):
@@ -48,6 +59,64 @@ class Tracker(ABC):
         """
         pass
 
+    def fit_window(self, t_start, t_end, **kwargs):
+        """Prepare for many boresight queries within a time window.
+
+        Does nothing by default.  Subclasses with expensive boresights can
+        override this to fit an interpolant over the window.
+
+        Parameters
+        ----------
+        t_start, t_end : astropy.time.Time or float
+            Start and end of the window, as times or GPS seconds
+
+        Returns
+        -------
+        error : float
+            Bound on the angle between interpolated and actual boresights in
+            radians; 0 if no interpolant is used
+        """
+        return 0.0
+
+    def get_boresights(self, times):
+        """Get the telescope boresight directions at many times at once.
+
+        Loops over `get_boresight`; subclasses should override this with a
+        vectorized implementation.
+
+        Parameters
+        ----------
+        times : astropy.time.Time or array_like
+            Times at which to compute boresights, or their GPS seconds
+
+        Returns
+        -------
+        xyz : array of shape (n, 3)
+            Unit vectors of the boresight directions
+        """
+        times = Time(_gps_seconds(times), format='gps')
+        return np.array([self.get_boresight(time).get_xyz() for time in times])
+
+    def get_rot_sky_positions(self, times):
+        """Get the camera rotation angles at many times at once.
+
+        Loops over `get_rot_sky_pos`; subclasses should override this with a
+        vectorized implementation.
+
+        Parameters
+        ----------
+        times : astropy.time.Time or array_like
+            Times at which to compute rotations, or their GPS seconds
+
+        Returns
+        -------
+        rot_sky_pos : array of shape (n,)
+            Position angles of camera "up" direction with respect to North in
+            radians
+        """
+        times = Time(_gps_seconds(times), format='gps')
+        return np.array([self.get_rot_sky_pos(time).rad for time in times])
+
 
 class OrbitTracker(Tracker):
     """Track a satellite orbit with the telescope.
@@ -69,7 +138,8 @@ class OrbitTracker(Tracker):
     mount : {'EQ'}, optional
         Mount type for rotator tracking (default: 'EQ' for equatorial mount)
     propagator : ssapy.Propagator, optional
-        Propagator to use for satellite motion prediction
+        Propagator to use for satellite motion prediction (default:
+        ssapy.KeplerianPropagator)
     """
     def __init__(self, *, orbit, observer, t0, rot_sky_pos0, mount='EQ',
                  propagator=None):
@@ -80,10 +150,16 @@ class OrbitTracker(Tracker):
         self.t0 = t0
         self.rot_sky_pos0 = rot_sky_pos0
         self.mount = mount
+        if propagator is None:
+            propagator = ssapy.KeplerianPropagator()
         self.propagator = propagator
+        self._window = None
 
     def get_boresight(self, time):
         """Get boresight direction by computing satellite position at given time.
+
+        Evaluates the interpolant from `fit_window` if `time` is within its
+        window.
         
         Parameters
         ----------
@@ -95,10 +171,101 @@ class OrbitTracker(Tracker):
         galsim.CelestialCoord
             Right ascension and declination of satellite
         """
+        if self._window is not None:
+            return galsim.CelestialCoord.from_xyz(
+                *self.get_boresights(time)[0]
+            )
         ra, dec, _ = ssapy.radec(self.orbit, time, observer=self.observer,
                                  propagator=self.propagator)
         return galsim.CelestialCoord(ra*galsim.radians, dec*galsim.radians)
 
+    def get_boresights(self, times):
+        """Get boresight directions by propagating the orbit to all times.
+
+        Times within the window of `fit_window` evaluate its interpolant
+        instead.
+
+        Parameters
+        ----------
+        times : astropy.time.Time or array_like
+            Times at which to compute satellite positions, or their GPS
+            seconds
+
+        Returns
+        -------
+        xyz : array of shape (n, 3)
+            Unit vectors towards the satellite
+        """
+        gps = _gps_seconds(times)
+        if self._window is None:
+            return self._propagate(gps)
+        t_start, t_end, coef = self._window
+        x = (2*gps - t_start - t_end)/(t_end - t_start)
+        inside = np.abs(x) <= 1
+        xyz = np.empty((len(gps), 3))
+        if np.any(inside):
+            xyz[inside] = _normed(chebval(x[inside], coef).T)
+        if not np.all(inside):
+            xyz[~inside] = self._propagate(gps[~inside])
+        return xyz
+
+    def fit_window(self, t_start, t_end, *, tol=1e-9, max_deg=15):
+        """Fit a Chebyshev interpolant of the boresight over a time window.
+
+        Over an exposure the tracked boresight is a very smooth curve, so a
+        low order polynomial in time reproduces it, and later boresight
+        queries within the window don't have to propagate the orbit.  The
+        degree is raised until the interpolant matches the propagated
+        boresight to `tol` at the extrema of the Chebyshev polynomial, which
+        lie between the interpolation nodes.
+
+        Parameters
+        ----------
+        t_start, t_end : astropy.time.Time or float
+            Start and end of the window, as times or GPS seconds
+        tol : float, optional
+            Target angular error in radians (default: 1e-9)
+        max_deg : int, optional
+            Maximum degree of the interpolant (default: 15)
+
+        Returns
+        -------
+        error : float
+            Largest angle between interpolated and propagated boresights at
+            the test points in radians.  If `max_deg` isn't enough to get it
+            below `tol`, the interpolant is not used and boresights are still
+            propagated.
+        """
+        t_start = _gps_seconds(t_start)[0]
+        t_end = _gps_seconds(t_end)[0]
+        self._window = None
+        deg = 3
+        while True:
+            x = chebpts1(deg+1)
+            coef = chebfit(
+                x, self._propagate(0.5*(t_start + t_end + x*(t_end - t_start))),
+                deg
+            )
+            xtest = np.cos(np.pi*np.arange(deg+2)/(deg+1))
+            xyz = self._propagate(
+                0.5*(t_start + t_end + xtest*(t_end - t_start))
+            )
+            error = np.max(np.linalg.norm(
+                _normed(chebval(xtest, coef).T) - xyz, axis=1
+            ))
+            if error <= tol or deg >= max_deg:
+                break
+            deg = min(deg+2, max_deg)
+        if error <= tol:
+            self._window = t_start, t_end, coef
+        return error
+
+    def _propagate(self, gps):
+        """Boresight unit vectors at GPS seconds from the orbit."""
+        ra, dec, _ = ssapy.radec(self.orbit, gps, observer=self.observer,
+                                 propagator=self.propagator)
+        return _radec_to_xyz(ra, dec)
+
     def get_rot_sky_pos(self, time):
         """Get camera rotation angle.
         
@@ -119,6 +286,22 @@ class OrbitTracker(Tracker):
         # TODO: other mount types
         return self.rot_sky_pos0
 
+    def get_rot_sky_positions(self, times):
+        """Get camera rotation angles.
+
+        Parameters
+        ----------
+        times : astropy.time.Time or array_like
+            Times at which to compute rotations, or their GPS seconds (unused
+            for EQ mounts)
+
+        Returns
+        -------
+        rot_sky_pos : array of shape (n,)
+            Camera rotation angles in radians (constant for EQ mounts)
+        """
+        return np.full(np.size(times), self.rot_sky_pos0.rad)
+
 
 class InertialTracker(Tracker):
     """Track by slewing at a constant rate with respect to the inertial sky.
@@ -158,12 +341,18 @@ class InertialTracker(Tracker):
         self.rot_rate = rot_rate
         self.mount = mount
 
-        if self.rot_rate != 0:
+        if not self.is_stationary:
+            self._t0_gps = t0.gps
             self._xyz0 = np.array(self.boresight0.get_xyz())
             axis_xyz = np.array(self.rot_axis.get_xyz())
             self._cross = np.cross(axis_xyz, self._xyz0)
             self._dot = np.dot(axis_xyz, self._xyz0)*axis_xyz
 
+    @property
+    def is_stationary(self):
+        """True for zero rotation rate, i.e., sidereal tracking."""
+        return self.rot_rate == 0
+
     def get_boresight(self, time):
         """Get boresight direction at given time using Rodriguez rotation formula.
         
@@ -177,17 +366,35 @@ class InertialTracker(Tracker):
         galsim.CelestialCoord
             Boresight direction rotated by (time - t0) * rot_rate around rot_axis
         """
-        if self.rot_rate == 0.0:
+        if self.is_stationary:
             return self.boresight0
-        theta = ((time-self.t0).sec)*self.rot_rate
+        return galsim.CelestialCoord.from_xyz(*self.get_boresights(time)[0])
+
+    def get_boresights(self, times):
+        """Get boresight directions at many times using the Rodriguez
+        rotation formula.
+
+        Parameters
+        ----------
+        times : astropy.time.Time or array_like
+            Times at which to compute boresights, or their GPS seconds
+
+        Returns
+        -------
+        xyz : array of shape (n, 3)
+            Unit vectors of the boresight rotated by (time - t0) * rot_rate
+            around rot_axis
+        """
+        if self.is_stationary:
+            return np.tile(self.boresight0.get_xyz(), (np.size(times), 1))
+        theta = ((_gps_seconds(times) - self._t0_gps)*self.rot_rate)[:, None]
         # Rodriguez rotation formula:
         # https://en.wikipedia.org/wiki/Axis%E2%80%93angle_representation
-        xyz = (
+        return (
             np.cos(theta)*self._xyz0 +
             np.sin(theta)*self._cross +
             (1-np.cos(theta))*self._dot
         )
-        return galsim.CelestialCoord.from_xyz(*xyz)
 
     def get_rot_sky_pos(self, time):
         """Get camera rotation angle.
@@ -209,6 +416,22 @@ class InertialTracker(Tracker):
         # TODO: other mount types
         return self.rot_sky_pos0
 
+    def get_rot_sky_positions(self, times):
+        """Get camera rotation angles.
+
+        Parameters
+        ----------
+        times : astropy.time.Time or array_like
+            Times at which to compute rotations, or their GPS seconds (unused
+            for EQ mounts)
+
+        Returns
+        -------
+        rot_sky_pos : array of shape (n,)
+            Camera rotation angles in radians (constant for EQ mounts)
+        """
+        return np.full(np.size(times), self.rot_sky_pos0.rad)
+
 
 def SiderealTracker(boresight0, rot_sky_pos0):
     """Create a sidereal tracker (stationary with respect to stars).
@@ -238,6 +461,32 @@ def SiderealTracker(boresight0, rot_sky_pos0):
         mount='EQ'
     )
 
+
+def _gps_seconds(times):
+    """Flat array of GPS seconds from astropy Times or from GPS seconds.
+
+    Tracking and rendering internals work on float GPS seconds, as ssapy does,
+    so that astropy Time arithmetic is only needed at the API boundaries.
+    """
+    if isinstance(times, Time):
+        return np.atleast_1d(times.gps).ravel()
+    return np.atleast_1d(np.asarray(times, dtype=float)).ravel()
+
+
+def _normed(xyz):
+    """Normalize vectors along the last axis."""
+    return xyz/np.linalg.norm(xyz, axis=-1, keepdims=True)
+
+
+def _radec_to_xyz(ra, dec):
+    """Unit vectors of ra, dec in radians, as galsim.CelestialCoord.get_xyz."""
+    return np.stack([
+        np.cos(dec)*np.cos(ra),
+        np.cos(dec)*np.sin(ra),
+        np.sin(dec)
+    ], axis=-1)
+
+
 def transform_wcs(wcs0, boresight1, rot_sky_pos1):
     """Transform WCS by recentering and reorienting it.
     
@@ -6,11 +6,47 @@ import galsim
 import numpy as np
 
 
+def _pixel_radius(th, dthdr, rho, ngrid=4097):
+    """Distance in pixels from the boresight for field angles.
+
+    The radius is the integral of the inverse plate scale out to the field
+    angle.  It is tabulated once on a fine grid of field angles with the
+    trapezoid rule and then interpolated for all `rho` at once.
+
+    Parameters
+    ----------
+    th : array
+        Field angles in degrees
+    dthdr: array
+        Radial plate scale in arcsec per pixel
+    rho : array
+        Field angles in degrees at which to evaluate the radius, up to th[-1]
+    ngrid: int
+        Number of field angles at which to tabulate the radial mapping
+
+    Returns
+    -------
+        r : array
+            Radius in pixels
+    """
+    from scipy.integrate import cumulative_trapezoid
+    from scipy.interpolate import interp1d
+
+    interp = interp1d(th, np.ravel(dthdr), kind='cubic')  # deg -> arcsec/pix
+    arcsec = np.linspace(0, th[-1]*3600, ngrid)
+    r_table = cumulative_trapezoid(
+        1./interp(arcsec/3600),  # arcsec -> pix/arcsec
+        arcsec,
+        initial=0
+    )
+    return np.interp(np.asarray(rho)*3600, arcsec, r_table)
+
+
 def radialWCS(
     th, dthdr,
     world_origin,
     rot_sky_pos=0*galsim.degrees,
-    n=10, order=3, verbose=False
+    n=10, order=3, ngrid=4097, verbose=False
 ):
     """Make a WCS from a radial distortion polynomial
 
@@ -28,16 +64,13 @@ def radialWCS(
         Number of control points to use
     order: int
         Order of SIP part of fitted WCS
+    ngrid: int
+        Number of field angles at which to tabulate the radial mapping
 
     Returns
     -------
         wcs : galsim.GSFitsWCS
     """
-    import warnings
-
-    from scipy.integrate import IntegrationWarning, quad
-    from scipy.interpolate import interp1d
-
     u = np.deg2rad(np.linspace(-th[-1], th[-1], n))
     u, v = np.meshgrid(u, u)
     rho = np.hypot(u, v)
@@ -46,18 +79,10 @@ def radialWCS(
     v = v[w]
     rho = rho[w]
 
-    interp = interp1d(th, dthdr, kind='cubic')  # deg -> arcsec/pix
-    integrand = lambda arcsec: 1./interp(arcsec/3600)  # arcsec -> pix/arcsec
-
-    x = np.empty_like(u)
-    y = np.empty_like(u)
-
-    for idx in np.ndindex(u.shape):
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore", category=IntegrationWarning)
-            r = quad(integrand, 0, np.rad2deg(rho[idx])*3600)[0]
-        x[idx] = r*u[idx]/rho[idx]
-        y[idx] = r*v[idx]/rho[idx]
+    r = _pixel_radius(th, dthdr, np.rad2deg(rho), ngrid=ngrid)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x = np.where(rho > 0, r*u/rho, 0.0)
+        y = np.where(rho > 0, r*v/rho, 0.0)
 
     sth, cth = np.sin(rot_sky_pos), np.cos(rot_sky_pos)
     R = np.array([[cth, -sth], [sth, cth]])
@@ -0,0 +1,25 @@
+from satist.catalog import convert_gaia_shards
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser = ArgumentParser(
+        description="Convert GAIA HTM FITS shards to the columnar layout read "
+                    "by satist.ColumnarGaiaStarCatalog."
+    )
+    parser.add_argument(
+        "gaia_dir",
+        type=str
+    )
+    parser.add_argument(
+        "out_dir",
+        type=str
+    )
+    parser.add_argument(
+        "--level",
+        type=int,
+        default=7
+    )
+    args = parser.parse_args()
+
+    convert_gaia_shards(args.gaia_dir, args.out_dir, level=args.level)
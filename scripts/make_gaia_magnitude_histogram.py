@@ -0,0 +1,28 @@
+from satist.photometry import (
+    GAIA_MAGNITUDE_HISTOGRAM_FILE,
+    get_gaia_magnitude_histogram,
+    save_gaia_magnitude_histogram
+)
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser = ArgumentParser(
+        description="Query the Gaia archive for the reference field magnitude "
+                    "histograms used by satist.MockStarCatalog and save them "
+                    "as package data."
+    )
+    parser.add_argument(
+        "--out",
+        type=str,
+        default=GAIA_MAGNITUDE_HISTOGRAM_FILE
+    )
+    parser.add_argument(
+        "--nbins",
+        type=int,
+        default=100
+    )
+    args = parser.parse_args()
+
+    results = get_gaia_magnitude_histogram(nbins=args.nbins)
+    save_gaia_magnitude_histogram(results, args.out)
@@ -12,8 +12,16 @@ if __name__ == "__main__":
         "config",
         type=str
     )
+    parser.add_argument(
+        "--n_workers",
+        type=int,
+        default=None,
+        help="Number of observations to render concurrently"
+    )
     args = parser.parse_args()
 
     config = yaml.safe_load(open(args.config, 'r'))
+    if args.n_workers is not None:
+        config['n_workers'] = args.n_workers
     simulate.simulate(config)
     simulate.make_sky_flat(args.config)
@@ -0,0 +1,165 @@
+import os
+import pickle
+import tempfile
+
+import galsim
+import numpy as np
+import yaml
+
+from satist.instrument import Instrument, add_ccd_noise
+
+itext = """
+instrument:
+    distortion:  # plate-scale (arcsec/micron) vs field angle (deg)
+        th: &th [0.        , 0.03448276, 0.06896552, 0.10344828, 0.13793103,
+            0.17241379, 0.20689655, 0.24137931, 0.27586207, 0.31034483,
+            0.34482759, 0.37931034, 0.4137931 , 0.44827586, 0.48275862,
+            0.51724138, 0.55172414, 0.5862069 , 0.62068966, 0.65517241,
+            0.68965517, 0.72413793, 0.75862069, 0.79310345, 0.82758621,
+            0.86206897, 0.89655172, 0.93103448, 0.96551724, 1.]
+        dthdr: [0.06124069, 0.06126784, 0.06124352, 0.06120296, 0.06114596,
+            0.06107225, 0.06098148, 0.06087321, 0.06074759, 0.06060343,
+            0.0604463 , 0.06029759, 0.06011246, 0.05992273, 0.05973642,
+            0.05947572, 0.05919784, 0.05893438, 0.05865396, 0.05834981,
+            0.05815874, 0.05775472, 0.05736799, 0.05702492, 0.0565666 ,
+            0.0563616 , 0.05585923, 0.05531151, 0.05477258, 0.05446725]
+    vignetting:  # surviving fraction vs field angle (deg)
+        th: *th
+        unvig: [0.86972549, 0.87259059, 0.87087748, 0.86941706, 0.86827994,
+            0.86648507, 0.86486115, 0.86346019, 0.86065827, 0.85650741,
+            0.85182144, 0.82975165, 0.78771911, 0.73632577, 0.67956641,
+            0.61945143, 0.55733349, 0.5019528 , 0.45624505, 0.41441689,
+            0.37429813, 0.3345807 , 0.29365183, 0.24876162, 0.19516092,
+            0.1444885 , 0.09833854, 0.05772925, 0.02454469, 0.00247119]
+    pixel_scale: 25.0 # microns
+    image_shape: [1800, 1536]  # pixels
+    gain: 2.0
+    read_noise: 5.0
+    aperture: 1.0  # m diameter
+    obscuration: 0.1  # fractional linear
+"""
+
+
+def make_instrument(**kwargs):
+    config = yaml.safe_load(itext)['instrument']
+    config.update(kwargs)
+    return Instrument.fromConfig(config)
+
+
+def test_limiting_nphot():
+    instrument = make_instrument()
+    for snr in [3.0, 5.0, 20.0]:
+        for length in [0.0, 10.0, 300.0]:
+            kwargs = dict(length=length, psf_fwhm=3.0, sky_phot=100.0)
+            nphot = instrument.limiting_nphot(snr=snr, **kwargs)
+            np.testing.assert_allclose(
+                instrument.streak_snr(nphot=nphot, **kwargs), snr, rtol=1e-10
+            )
+
+
+def test_maps():
+    instrument = make_instrument()
+    nx, ny = instrument.image_shape
+    for name in ['pixel_area_map', 'vignetting_map']:
+        array = getattr(instrument, name)
+        assert array.dtype == np.float32
+        assert array.shape == (ny, nx)
+
+    # Sky is proportional to pixel area
+    image = instrument.init_image(sky_phot=100.0, exptime=10.0)
+    wcs = instrument.get_wcs(
+        galsim.CelestialCoord(0*galsim.degrees, 0*galsim.degrees),
+        0*galsim.degrees
+    )
+    for x, y in [(0, 0), (-900, -768), (899, 767), (300, -200)]:
+        np.testing.assert_allclose(
+            image(x, y), 1000.0*wcs.pixelArea(galsim.PositionD(x, y)),
+            rtol=1e-6
+        )
+
+    # Vignetting of the full image uses the map; other bounds are evaluated
+    # directly, and both agree
+    instrument.apply_vignetting(image)
+    stamp = galsim.ImageD(galsim.BoundsI(-10, 20, 700, 767), init_value=1.0)
+    instrument.apply_vignetting(stamp)
+    np.testing.assert_allclose(
+        stamp.array, instrument.vignetting_map[-68:, 890:921], rtol=1e-6
+    )
+    np.testing.assert_allclose(
+        image.array, 1000.0*instrument.pixel_area_map*instrument.vignetting_map,
+        rtol=1e-6
+    )
+
+    # Precomputed maps travel with the instrument to worker processes
+    instrument = make_instrument()
+    instrument.precompute()
+    copy = pickle.loads(pickle.dumps(instrument))
+    for name in ['_fiducial_wcs', 'pixel_area_map', 'vignetting_map']:
+        assert name in vars(copy)
+    np.testing.assert_array_equal(
+        copy.vignetting_map, instrument.vignetting_map
+    )
+
+
+def test_map_cache():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        instrument = make_instrument(cache_dir=cache_dir)
+        vignetting = instrument.vignetting_map
+        files = os.listdir(cache_dir)
+        assert len(files) == 1
+
+        # A new instrument with the same config loads the cached map
+        cached = make_instrument(cache_dir=cache_dir)
+        np.testing.assert_array_equal(cached.vignetting_map, vignetting)
+        assert os.listdir(cache_dir) == files
+
+        # A different config gets its own cache file
+        other = make_instrument(cache_dir=cache_dir, pixel_scale=20.0)
+        other.vignetting_map
+        assert len(os.listdir(cache_dir)) == 2
+
+
+def test_add_ccd_noise():
+    sky_level, gain, read_noise = 50.0, 2.0, 5.0
+    array = np.full((300, 200), 100.0)
+    array[150:] = 400.0
+    noisy = array.copy()
+    add_ccd_noise(
+        noisy, sky_level=sky_level, gain=gain, read_noise=read_noise, seed=57
+    )
+    # Poisson noise in electrons and read noise, as galsim.CCDNoise
+    for rows, level in [(slice(None, 150), 100.0), (slice(150, None), 400.0)]:
+        diff = noisy[rows] - array[rows]
+        var = (level + sky_level)/gain + (read_noise/gain)**2
+        assert abs(np.mean(diff)) < 5*np.sqrt(var/diff.size)
+        np.testing.assert_allclose(np.var(diff), var, rtol=0.05)
+
+    # The noise doesn't depend on the number of threads, but on the seed
+    for n_threads in [2, 3]:
+        other = array.copy()
+        add_ccd_noise(
+            other, sky_level=sky_level, gain=gain, read_noise=read_noise,
+            seed=57, n_threads=n_threads
+        )
+        np.testing.assert_array_equal(other, noisy)
+    add_ccd_noise(
+        array, sky_level=sky_level, gain=gain, read_noise=read_noise, seed=58
+    )
+    assert not np.array_equal(array, noisy)
+
+    # Both engines draw the same number of values from the rng
+    instrument = make_instrument()
+    image = galsim.ImageF(galsim.BoundsI(0, 99, 0, 99), init_value=100.0)
+    rngs = []
+    for engine in ['galsim', 'numpy']:
+        rng = np.random.default_rng(5)
+        instrument.apply_noise(image, 100.0, rng, engine=engine)
+        rngs.append(rng.random())
+    assert rngs[0] == rngs[1]
+
+
+if __name__ == "__main__":
+    test_limiting_nphot()
+    test_maps()
+    test_map_cache()
+    test_add_ccd_noise()
@@ -1,10 +1,16 @@
+import os
+
 import pytest
 import numpy as np
 from astropy.table import Table
+import satist.photometry
 from satist.photometry import (
     convert_gaia_magnitude,
     get_gaia_sources,
     get_gaia_magnitude_histogram,
+    load_gaia_magnitude_histogram,
+    read_gaia_magnitude_histogram,
+    save_gaia_magnitude_histogram,
     vega_to_ab_offset
 )
 
@@ -50,6 +56,24 @@ def test_get_gaia_magnitude_histogram():
         assert len(results[filter]['bins']) == nbins, f"Expected {nbins} bins for {filter}, got {len(results[filter]['bins'])}"
 
 
+def test_gaia_magnitude_histogram_file(tmp_path):
+    rng = np.random.default_rng(57721)
+    results = {}
+    for filter in ['G', 'BP', 'RP']:
+        results[filter] = {
+            'bins': np.linspace(5, 21, 100),
+            'values': rng.integers(0, 1000, size=99)
+        }
+    filename = tmp_path/"hist.npz"
+    save_gaia_magnitude_histogram(results, filename)
+    loaded = read_gaia_magnitude_histogram(filename)
+
+    assert set(loaded) == set(results)
+    for filter in results:
+        np.testing.assert_array_equal(loaded[filter]['bins'], results[filter]['bins'])
+        np.testing.assert_array_equal(loaded[filter]['values'], results[filter]['values'])
+
+
 # Test for vega_to_ab_offset
 def test_vega_to_ab_offset():
     offsets = {
@@ -64,3 +88,38 @@ def test_vega_to_ab_offset():
     for filter_name, expected_offset in offsets.items():
         result = vega_to_ab_offset(filter_name)
         assert np.isclose(result, expected_offset), f"Expected {expected_offset} for {filter_name}, got {result}"
+
+
+def test_load_gaia_magnitude_histogram(tmp_path, monkeypatch):
+    filename = tmp_path/"hist.npz"
+    monkeypatch.setattr(
+        satist.photometry, "GAIA_MAGNITUDE_HISTOGRAM_FILE", str(filename)
+    )
+    # A missing file is an error unless querying the archive is allowed
+    with pytest.raises(FileNotFoundError):
+        load_gaia_magnitude_histogram()
+
+    results = {
+        filter: {'bins': np.linspace(5, 21, 11), 'values': np.arange(10)}
+        for filter in ['G', 'BP', 'RP']
+    }
+    save_gaia_magnitude_histogram(results, filename)
+    loaded = load_gaia_magnitude_histogram()
+    assert set(loaded) == set(results)
+    np.testing.assert_array_equal(loaded['G']['values'], np.arange(10))
+    # The file is read once
+    assert load_gaia_magnitude_histogram() is loaded
+
+
+@pytest.mark.skipif(
+    not os.path.exists(satist.photometry.GAIA_MAGNITUDE_HISTOGRAM_FILE),
+    reason="Gaia magnitude histograms not generated yet, see "
+           "scripts/make_gaia_magnitude_histogram.py"
+)
+def test_bundled_gaia_magnitude_histogram():
+    hists = load_gaia_magnitude_histogram()
+    assert set(hists) == {'G', 'BP', 'RP'}
+    for hist in hists.values():
+        assert len(hist['bins']) == len(hist['values']) + 1
+        assert np.all(np.diff(hist['bins']) > 0)
+        assert np.all(hist['values'] >= 0) and hist['values'].sum() > 0
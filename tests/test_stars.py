@@ -1,6 +1,20 @@
+import os
+
 import numpy as np
+import pytest
 import galsim
+import astropy.units as u
+import lsst.sphgeom as sphgeom
+from astropy.table import Table
+from astropy.time import Time
+import satist.catalog
+import satist.photometry
 import satist.tools
+from satist.catalog import (
+    ColumnarGaiaStarCatalog, GaiaStarCatalog, StarCatalog, TrixelCache,
+    convert_gaia_shards, _catalog_to_apparent, _in_swept_cap,
+    _swept_cap_envelope
+)
 
 
 def test_mock_star_catalog():
@@ -26,5 +40,238 @@ def test_mock_star_catalog():
         assert np.all(np.isin(stars1, stars2))
 
 
+def test_mock_star_catalog_gaia_mags(tmp_path, monkeypatch):
+    filename = tmp_path/"hist.npz"
+    monkeypatch.setattr(
+        satist.photometry, "GAIA_MAGNITUDE_HISTOGRAM_FILE", str(filename)
+    )
+    center = galsim.CelestialCoord(30*galsim.degrees, -20*galsim.degrees)
+    radius = 0.1*galsim.degrees
+    # Without Gaia magnitudes the histograms are not needed
+    stars1 = satist.catalog.MockStarCatalog().get_stars(
+        center, center, radius, None
+    )
+    catalog = satist.catalog.MockStarCatalog(gaia_mags=True)
+    with pytest.raises(FileNotFoundError):
+        catalog.get_stars(center, center, radius, None)
+
+    results = {
+        filter: {'bins': np.linspace(5, 21, 11), 'values': np.arange(1, 11)}
+        for filter in ['G', 'BP', 'RP']
+    }
+    satist.photometry.save_gaia_magnitude_histogram(results, filename)
+    stars2 = catalog.get_stars(center, center, radius, None)
+    # Gaia magnitudes are added on top of the same stars
+    for col in stars1.colnames:
+        np.testing.assert_array_equal(stars1[col], stars2[col])
+    for filter in ['G', 'BP', 'RP']:
+        mag = stars2[f'{filter}_mag'] - satist.photometry.vega_to_ab_offset(filter)
+        assert np.all((mag >= 5) & (mag < 21))
+
+
+def test_swept_cap():
+    rng = np.random.default_rng(2718)
+    htm = sphgeom.HtmPixelization(7)
+    for arc in [0.0, 0.3, 2.0]:
+        p0 = galsim.CelestialCoord(
+            rng.uniform(0, 360)*galsim.degrees,
+            rng.uniform(-60, 60)*galsim.degrees
+        )
+        p1 = p0.greatCirclePoint(
+            galsim.CelestialCoord.from_xyz(*rng.normal(size=3)),
+            arc*galsim.degrees
+        )
+        radius = 0.5*galsim.degrees
+        # Brute force: distance to densely sampled points along the arc
+        arc_points = [
+            p0.greatCirclePoint(p1, t*arc*galsim.degrees)
+            for t in np.linspace(0, 1, 2001)
+        ] if arc > 0 else [p0]
+        points = [
+            p0.greatCirclePoint(
+                galsim.CelestialCoord.from_xyz(*rng.normal(size=3)),
+                rng.uniform(0, arc+1.0)*galsim.degrees
+            )
+            for _ in range(2000)
+        ]
+        arc_xyz = np.array([a.get_xyz() for a in arc_points])
+        xyz = np.array([point.get_xyz() for point in points])
+        dist = np.rad2deg(np.arccos(np.clip(
+            np.max(xyz @ arc_xyz.T, axis=1), -1, 1
+        )))
+        ra = np.array([point.ra.rad for point in points])
+        dec = np.array([point.dec.rad for point in points])
+        xyz0 = np.array(p0.get_xyz())
+        xyz1 = np.array(p1.get_xyz())
+        inside = _in_swept_cap(ra, dec, xyz0, xyz1, radius.rad)
+        tol = 1e-3  # degrees; spacing of the brute force samples
+        assert np.all(inside[dist < 0.5-tol])
+        assert not np.any(inside[dist > 0.5+tol])
+
+        ranges = _swept_cap_envelope(htm, xyz0, xyz1, radius.rad)
+        for point in np.array(points)[dist < 0.5]:
+            idx = htm.index(sphgeom.UnitVector3d(*point.get_xyz()))
+            assert ranges.contains(idx)
+
+
+def test_catalog_to_apparent():
+    from ssapy.utils import catalog_to_apparent
+
+    rng = np.random.default_rng(14142)
+    n = 1000
+    ra = rng.uniform(0, 2*np.pi, n)
+    dec = np.arcsin(rng.uniform(-1, 1, n))
+    pmra, pmdec = rng.normal(0, 100, (2, n))
+    parallax = rng.uniform(0, 0.5, n)
+    time = Time("2021-03-04T05:06:07")
+    for dt in [0.0, 1.0, 30.0]:
+        ra1, dec1 = _catalog_to_apparent(
+            ra, dec, time + dt*u.s, pmra, pmdec, parallax
+        )
+        ra2, dec2 = catalog_to_apparent(
+            ra, dec, time + dt*u.s,
+            pmra=pmra, pmdec=pmdec, parallax=parallax
+        )
+        dra = (ra1 - ra2 + np.pi) % (2*np.pi) - np.pi
+        # Within the ~0.1 mas error of sharing the Earth's state
+        np.testing.assert_allclose(dra*np.cos(dec2), 0, rtol=0, atol=1e-9)
+        np.testing.assert_allclose(dec1, dec2, rtol=0, atol=1e-9)
+
+
+def test_trixel_cache():
+    def load(idx):
+        table = Table()
+        table['x'] = np.full(100, idx, dtype=float)  # 800 bytes
+        return table
+
+    cache = TrixelCache(max_bytes=2000)
+    assert cache.get(1, load)['x'][0] == 1
+    assert cache.get(2, load)['x'][0] == 2
+    assert cache.get(1, load)['x'][0] == 1
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    # Adding a third table evicts the least recently used one (2).
+    cache.get(3, load)
+    assert len(cache) == 2
+    assert cache.nbytes == 1600
+    cache.get(1, load)
+    assert cache.hits == 2
+    cache.get(2, load)
+    assert cache.misses == 4
+
+
+def test_catalog_cache():
+    class CountingCatalog(StarCatalog):
+        def __init__(self):
+            super().__init__()
+            self.nload = 0
+
+        def _load_trixel(self, idx):
+            self.nload += 1
+            trixel = self.htm.triangle(idx)
+            center = trixel.getBoundingCircle().getCenter()
+            table = Table()
+            table['ra_rad'] = [np.arctan2(center.y(), center.x())]
+            table['dec_rad'] = [np.arcsin(center.z())]
+            table['i_mag'] = [15.0]
+            return table
+
+    catalog = CountingCatalog()
+    center = galsim.CelestialCoord(10*galsim.degrees, 20*galsim.degrees)
+    stars1 = catalog.get_stars(center, center, 1*galsim.degrees, None)
+    nload = catalog.nload
+    assert catalog.cache.misses == nload
+    stars2 = catalog.get_stars(center, center, 1*galsim.degrees, None)
+    assert catalog.nload == nload
+    assert catalog.cache.hits == nload
+    np.testing.assert_array_equal(stars1['ra_rad'], stars2['ra_rad'])
+
+
+def write_gaia_shards(gaia_dir, center, radius, nstar, rng, level=7):
+    """Write random stars around center as HTM-pixelized GAIA FITS shards."""
+    htm = sphgeom.HtmPixelization(level)
+    # Points roughly uniform in a disk around center
+    points = [
+        center.greatCirclePoint(
+            galsim.CelestialCoord.from_xyz(*rng.normal(size=3)),
+            np.sqrt(rng.uniform(0, radius.rad**2))*galsim.radians
+        )
+        for _ in range(nstar)
+    ]
+    ra = np.array([p.ra.rad for p in points])
+    dec = np.array([p.dec.rad for p in points])
+    idxs = np.array([
+        htm.index(sphgeom.UnitVector3d(*p.get_xyz())) for p in points
+    ])
+    circle = sphgeom.Circle(
+        sphgeom.UnitVector3d(*center.get_xyz()),
+        sphgeom.Angle.fromRadians(radius.rad)
+    )
+    for start, end in htm.envelope(circle):
+        for idx in range(start, end):
+            w = idxs == idx
+            table = Table()
+            table['coord_ra'] = ra[w]*u.rad
+            table['coord_dec'] = dec[w]*u.rad
+            table['pm_ra'] = np.deg2rad(rng.normal(0, 5e-3/3600, w.sum()))*u.rad
+            table['pm_dec'] = np.deg2rad(rng.normal(0, 5e-3/3600, w.sum()))*u.rad
+            table['parallax'] = np.deg2rad(rng.uniform(0, 1e-6, w.sum()))*u.rad
+            flux = 10**(-0.4*(rng.uniform(8, 20, w.sum()) - 31.4))
+            flux[::10] = -1.0  # some bad fluxes
+            table['phot_g_mean_flux'] = flux*u.nJy
+            table.write(os.path.join(gaia_dir, f"{idx}.fits"))
+
+
+def test_columnar_catalog(tmp_path):
+    rng = np.random.default_rng(1618)
+    gaia_dir = tmp_path/"gaia"
+    columnar_dir = tmp_path/"columnar"
+    os.makedirs(gaia_dir)
+    center = galsim.CelestialCoord(45*galsim.degrees, 30*galsim.degrees)
+    write_gaia_shards(gaia_dir, center, 1.5*galsim.degrees, 5000, rng)
+    convert_gaia_shards(gaia_dir, columnar_dir)
+
+    fits_catalog = GaiaStarCatalog(gaia_dir)
+    columnar_catalog = ColumnarGaiaStarCatalog(columnar_dir)
+    time = Time("2020-01-01T00:00:00")
+    stars1 = fits_catalog.get_stars(center, center, 0.5*galsim.degrees, time)
+    stars2 = columnar_catalog.get_stars(center, center, 0.5*galsim.degrees, time)
+    assert len(stars1) > 100
+    assert len(stars1) == len(stars2)
+    # Columnar trixels are sorted by magnitude, so match up rows first.
+    stars1 = stars1[np.argsort(stars1['ra_rad'])]
+    stars2 = stars2[np.argsort(stars2['ra_rad'])]
+    np.testing.assert_allclose(stars1['ra_rad'], stars2['ra_rad'], rtol=0, atol=1e-12)
+    np.testing.assert_allclose(stars1['dec_rad'], stars2['dec_rad'], rtol=0, atol=1e-12)
+    np.testing.assert_allclose(stars1['i_mag'], stars2['i_mag'], rtol=0, atol=1e-5)
+
+    # Magnitude-limited queries only read the bright end of each trixel
+    stars3 = columnar_catalog.get_stars(
+        center, center, 0.5*galsim.degrees, time, mag_limit=15.0
+    )
+    w = stars2['i_mag'] <= 15.0
+    assert 0 < len(stars3) < len(stars2)
+    np.testing.assert_array_equal(np.sort(stars3['ra_rad']), np.sort(stars2['ra_rad'][w]))
+    stars4 = fits_catalog.get_stars(
+        center, center, 0.5*galsim.degrees, time, mag_limit=15.0
+    )
+    np.testing.assert_array_equal(np.sort(stars4['ra_rad']), np.sort(stars1['ra_rad'][w]))
+
+    # Unknown trixels are empty
+    assert len(columnar_catalog._load_trixel(8*4**7)) == 0
+
+    # Concurrent trixel loading gives the same rows in the same order
+    threaded_catalog = GaiaStarCatalog(gaia_dir, n_threads=4)
+    stars5 = threaded_catalog.get_stars(center, center, 0.5*galsim.degrees, time)
+    stars6 = fits_catalog.get_stars(center, center, 0.5*galsim.degrees, time)
+    np.testing.assert_array_equal(stars5['ra_rad'], stars6['ra_rad'])
+    np.testing.assert_array_equal(stars5['i_mag'], stars6['i_mag'])
+    assert threaded_catalog.cache.misses == fits_catalog.cache.misses
+
+
 if __name__ == "__main__":
-    test_mock_star_catalog()
\ No newline at end of file
+    test_mock_star_catalog()
+    test_swept_cap()
+    test_catalog_to_apparent()
+    test_trixel_cache()
+    test_catalog_cache()
\ No newline at end of file
@@ -0,0 +1,554 @@
+import astropy.units as u
+import numpy as np
+import galsim
+import pytest
+import ssapy
+from astropy.table import Table, vstack
+from astropy.time import Time
+
+from satist.tools import (
+    PhotonBudget, StampCache, draw_sat, draw_stars, generate_orbit,
+    getLineGSObject, _adaptive_nsplit,
+    _add_background,
+    _convolve_segments, _line_geometry, _local_jacobians, _overlaps,
+    _segment_footprints
+)
+from satist.tracker import InertialTracker, SiderealTracker
+from satist.wcs import radialWCS
+
+
+def make_wcs(boresight, rot_sky_pos=30*galsim.degrees):
+    th = np.linspace(0, 1, 30)
+    dthdr = 1.5 - 0.1*th**2  # arcsec / pixel
+    return radialWCS(th, dthdr, boresight, rot_sky_pos, n=8, order=3)
+
+
+def test_line_geometry():
+    rng = np.random.default_rng(3141)
+    ncp = galsim.CelestialCoord(0*galsim.degrees, 90*galsim.degrees)
+    ra0 = rng.uniform(0, 2*np.pi, size=20)
+    dec0 = rng.uniform(-1.4, 1.4, size=20)
+    ra1 = ra0 + rng.normal(scale=1e-3, size=20)
+    dec1 = dec0 + rng.normal(scale=1e-3, size=20)
+    length, q = _line_geometry(ra0, dec0, ra1, dec1)
+    for i in range(20):
+        p0 = galsim.CelestialCoord(ra0[i]*galsim.radians, dec0[i]*galsim.radians)
+        p1 = galsim.CelestialCoord(ra1[i]*galsim.radians, dec1[i]*galsim.radians)
+        np.testing.assert_allclose(
+            length[i], p0.distanceTo(p1)/galsim.arcsec, rtol=1e-9
+        )
+        np.testing.assert_allclose(
+            q[i], p0.angleBetween(ncp, p1).rad, rtol=0, atol=1e-9
+        )
+
+
+def test_local_jacobians():
+    boresight = galsim.CelestialCoord(150*galsim.degrees, -30*galsim.degrees)
+    wcs = make_wcs(boresight)
+    rng = np.random.default_rng(1414)
+    x, y = rng.uniform(-1000, 1000, size=(2, 20))
+    jac = _local_jacobians(wcs, x, y)
+    for i in range(20):
+        local = wcs.local(galsim.PositionD(x[i], y[i]))
+        np.testing.assert_allclose(
+            jac[i], local.getMatrix(), rtol=0, atol=1e-6
+        )
+
+
+def test_adaptive_nsplit():
+    # Chord deviation drops with the square of the number of segments
+    sagitta = np.array([0.0, 0.05, 0.2, 0.9, 100.0])
+    np.testing.assert_array_equal(
+        _adaptive_nsplit(sagitta, 2, 0.1), [1, 1, 2, 3, 32]
+    )
+    np.testing.assert_array_equal(_adaptive_nsplit(sagitta, 4), [4]*5)
+    # Trails that need more than max_nsplit segments are capped with a warning
+    with pytest.warns(UserWarning, match="deviate by up to 1 px"):
+        nsegs = _adaptive_nsplit(sagitta, 2, 0.1, max_nsplit=10)
+    np.testing.assert_array_equal(nsegs, [1, 1, 2, 3, 10])
+
+    t0 = Time("2020-01-01T00:00:00")
+    boresight = galsim.CelestialCoord(150*galsim.degrees, -30*galsim.degrees)
+    wcs0 = make_wcs(boresight)
+    # Fast rotation about a nearby axis makes strongly curved trails
+    tracker = InertialTracker(
+        t0=t0,
+        boresight0=boresight,
+        rot_sky_pos0=30*galsim.degrees,
+        rot_axis=galsim.CelestialCoord(
+            150*galsim.degrees, -29.9*galsim.degrees
+        ),
+        rot_rate=(20*galsim.degrees).rad
+    )
+    psf = galsim.Gaussian(fwhm=3.0)
+    stars = Table()
+    stars['ra'], stars['dec'] = wcs0.xyToradec(
+        np.array([-100.0, 200.0]), np.array([0.0, -150.0]), units='degrees'
+    )
+    stars['nphot'] = [1e4, 1e4]
+    nsegs = []
+    for max_error in [None, 1e3, 0.1]:
+        stamp_cache = StampCache(psf)
+        image = galsim.ImageD(galsim.BoundsI(-512, 511, -512, 511))
+        draw_stars(
+            stars.copy(), t0=t0, exptime=1.0, wcs0=wcs0, tracker=tracker,
+            psf=psf, image=image, nsplit=8, rng=np.random.default_rng(57),
+            method='stamp', stamp_cache=stamp_cache, max_error=max_error,
+            max_nsplit=8
+        )
+        nsegs.append(
+            stamp_cache.hits + stamp_cache.misses + stamp_cache.shot
+        )
+        np.testing.assert_allclose(
+            image.array.sum(), 2e4, rtol=0, atol=5*np.sqrt(2e4)
+        )
+    assert nsegs[0] == 2*8
+    assert nsegs[1] == 2
+    assert 2 < nsegs[2] <= 2*8
+
+
+def test_segment_footprints():
+    boresight = galsim.CelestialCoord(150*galsim.degrees, -30*galsim.degrees)
+    wcs = make_wcs(boresight)
+    psf = galsim.Kolmogorov(fwhm=3.0)
+    x0 = np.array([-300.3, 10.6, 255.2])
+    y0 = np.array([-200.7, 20.1, 255.5])
+    x1 = x0 + np.array([0.0, 22.3, -14.4])
+    y1 = y0 + np.array([0.0, 13.9, 28.2])
+    footprints = _segment_footprints(x0, y0, x1, y1, wcs=wcs, psf=psf)
+    for i, (xmin, xmax, ymin, ymax) in enumerate(zip(*footprints)):
+        # Footprints hold all but the far wings of each segment
+        p0 = wcs.toWorld(galsim.PositionD(x0[i], y0[i]))
+        p1 = wcs.toWorld(galsim.PositionD(x1[i], y1[i]))
+        center = galsim.PositionD(0.5*(x0[i]+x1[i]), 0.5*(y0[i]+y1[i]))
+        stamp = galsim.Convolve(getLineGSObject(p0, p1), psf).drawImage(
+            wcs=wcs.local(center), center=center, method='no_pixel'
+        )
+        bounds = galsim.BoundsI(xmin, xmax, ymin, ymax)
+        assert stamp[stamp.bounds & bounds].array.sum() > 0.995
+
+    bounds = galsim.BoundsI(-250, 249, -250, 249)
+    np.testing.assert_array_equal(
+        _overlaps(footprints, bounds), [False, True, True]
+    )
+    # Stars outside the image are not drawn, those straddling its edge only
+    # partly
+    t0 = Time("2020-01-01T00:00:00")
+    tracker = SiderealTracker(boresight, 30*galsim.degrees)
+    stars = Table()
+    stars['ra'], stars['dec'] = wcs.xyToradec(
+        np.array([0.0, 249.5, 600.0]), np.array([0.0, -50.0, 0.0]),
+        units='degrees'
+    )
+    stars['nphot'] = [1e4, 1e4, 1e4]
+    for method in ['phot', 'batch']:
+        image = galsim.ImageD(bounds)
+        draw_stars(
+            stars, t0=t0, exptime=1.0, wcs0=wcs, tracker=tracker,
+            psf=psf, image=image, rng=np.random.default_rng(7),
+            method=method
+        )
+        np.testing.assert_allclose(
+            image.array.sum(), 1.5e4, rtol=0, atol=5*np.sqrt(1.5e4)
+        )
+
+
+def test_photon_budget():
+    flux = np.array([10.0, 5e5, 30.0, 2e3, 1e3])
+    budget = PhotonBudget(threshold=1e4)
+    np.testing.assert_array_equal(
+        budget.split(flux), [False, True, False, False, False]
+    )
+    # The brightest segments beyond the budget are drawn analytically
+    budget = PhotonBudget(threshold=1e4, budget=1100)
+    np.testing.assert_array_equal(
+        budget.split(flux), [False, True, False, True, False]
+    )
+    assert budget.shot == 1040
+    assert budget.split([50.0, 70.0]).tolist() == [False, True]
+    assert (budget.shot, budget.n_shot, budget.n_analytic) == (1090, 4, 3)
+    assert budget.analytic == flux.sum() + 70 - 1040
+
+    # Long trails are shot if drawing their large footprint analytically
+    # costs more
+    footprints = ([0, 0], [99, 599], [0, 0], [49, 49])
+    for budget in [PhotonBudget(threshold=1e4), PhotonBudget(budget=0)]:
+        np.testing.assert_array_equal(
+            budget.split([5e4, 5e4], footprints=footprints), [True, False]
+        )
+        assert budget.shot == 5e4
+
+    # Analytic drawing matches photon shooting
+    t0 = Time("2020-01-01T00:00:00")
+    boresight = galsim.CelestialCoord(150*galsim.degrees, -30*galsim.degrees)
+    wcs0 = make_wcs(boresight)
+    tracker = InertialTracker(
+        t0=t0,
+        boresight0=boresight,
+        rot_sky_pos0=30*galsim.degrees,
+        rot_axis=galsim.CelestialCoord(0*galsim.degrees, 90*galsim.degrees),
+        rot_rate=(45/10*galsim.arcsec).rad
+    )
+    psf = galsim.Gaussian(fwhm=3.0)
+    stars = Table()
+    stars['ra'], stars['dec'] = wcs0.xyToradec(
+        np.array([-150.0, 200.0]), np.array([100.0, -180.0]), units='degrees'
+    )
+    stars['nphot'] = [1e6, 1e3]
+    images = []
+    for budget in [None, PhotonBudget(threshold=1e4)]:
+        image = galsim.ImageD(galsim.BoundsI(-256, 255, -256, 255))
+        draw_stars(
+            stars.copy(), t0=t0, exptime=10.0, wcs0=wcs0, tracker=tracker,
+            psf=psf, image=image, nsplit=2, rng=np.random.default_rng(11),
+            photon_budget=budget
+        )
+        images.append(image.array)
+    assert (budget.n_analytic, budget.n_shot) == (2, 2)
+    # Poisson noise of the difference per pixel
+    diff = images[1] - images[0]
+    assert np.abs(diff.sum()) < 5*np.sqrt(images[0].sum()*2)
+    lit = images[0] > 20
+    chi = diff[lit]/np.sqrt(images[0][lit] + images[1][lit])
+    assert np.abs(chi.mean()) < 5/np.sqrt(lit.sum())
+    np.testing.assert_allclose(chi.std(), 1, atol=0.1)
+
+
+def test_add_background():
+    image = galsim.ImageD(galsim.BoundsI(-50, 49, -40, 39))
+    x = np.array([-50.4, 49.2, 0.0, 10.0, 80.0])
+    y = np.array([-40.0, 39.4, 0.0, 30.0, 0.0])
+    flux = np.array([320.0, 80.0, 1024.0, 1024.0, 1e6])
+    _add_background(image, x, y, flux, cell_size=32)
+    # The source off the image is dropped, the rest is spread over cells
+    np.testing.assert_allclose(image.array.sum(), flux[:-1].sum())
+    # The density is flat up to the first cell centers, and zero in cells
+    # with no sources within one cell
+    np.testing.assert_allclose(image.array[:16, :16], 320/32**2)
+    np.testing.assert_array_equal(image.array[72:, :16], 0)
+    # The background is continuous across cell boundaries: along the first
+    # rows it drops linearly from one cell center to the next, including
+    # across the boundary at x = 32
+    np.testing.assert_allclose(
+        np.diff(image.array[:16, 16:48], axis=1), -320/32**2/32
+    )
+
+    # draw_stars folds stars that are not rendered
+    t0 = Time("2020-01-01T00:00:00")
+    boresight = galsim.CelestialCoord(150*galsim.degrees, -30*galsim.degrees)
+    wcs0 = make_wcs(boresight)
+    tracker = SiderealTracker(boresight, 30*galsim.degrees)
+    stars = Table()
+    stars['ra'], stars['dec'] = wcs0.xyToradec(
+        np.array([-100.0, 100.0]), np.array([0.0, 0.0]), units='degrees'
+    )
+    stars['nphot'] = [1e4, 1e3]
+    stars['rendered'] = [True, False]
+    image = galsim.ImageD(galsim.BoundsI(-256, 255, -256, 255))
+    draw_stars(
+        stars, t0=t0, exptime=1.0, wcs0=wcs0, tracker=tracker,
+        psf=galsim.Gaussian(fwhm=3.0), image=image,
+        rng=np.random.default_rng(3), background_cell=64
+    )
+    # The folded flux stays within one cell of the center of its cell
+    np.testing.assert_allclose(
+        image[galsim.BoundsI(32, 159, -32, 95)].array.sum(), 1e3
+    )
+    np.testing.assert_allclose(image.array.sum(), 1.1e4, atol=5*np.sqrt(1e4))
+
+
+def test_draw_sat():
+    t0 = Time("2020-01-01T06:00:00")
+    observer = ssapy.EarthObserver(lon=-110.0, lat=32.0, elevation=2000.0)
+    boresight = galsim.CelestialCoord(150*galsim.degrees, 20*galsim.degrees)
+    wcs0 = make_wcs(boresight)
+    tracker = SiderealTracker(boresight, 30*galsim.degrees)
+    psf = galsim.Gaussian(fwhm=3.0)
+    orbits = [
+        generate_orbit(
+            height, boresight, heading*galsim.degrees, 7e3, 0.0, observer, t0
+        )
+        for height, heading in [(3e7, 30.0), (3.5e7, 200.0), (3.2e7, 95.0)]
+    ]
+    nphot = [1e4, 2e4, 3e4]
+    kwargs = dict(
+        t0=t0, exptime=2.0, wcs0=wcs0, tracker=tracker, psf=psf,
+        observer=observer, max_error=0.1
+    )
+    image = galsim.ImageD(galsim.BoundsI(-256, 255, -256, 255))
+    sats, wcst = draw_sat(
+        orbits, image=image, nphot=nphot, rng=np.random.default_rng(2),
+        **kwargs
+    )
+    np.testing.assert_allclose(
+        image.array.sum(), sum(nphot), rtol=0, atol=5*np.sqrt(sum(nphot))
+    )
+    # Satellites propagated and projected together match drawing them one
+    # at a time
+    single = vstack([
+        draw_sat(
+            [orbit], image=galsim.ImageD(image.bounds), nphot=[n], **kwargs
+        )[0]
+        for orbit, n in zip(orbits, nphot)
+    ])
+    for name in sats.colnames:
+        np.testing.assert_allclose(sats[name], single[name], rtol=1e-12)
+    ra, dec, _ = ssapy.radec(orbits[1], t0 + 2.0*u.s, observer=observer)
+    np.testing.assert_allclose(
+        wcst.radecToxy(ra, dec, units='radians'),
+        (sats['x1'][1], sats['y1'][1]), rtol=0, atol=1e-9
+    )
+
+
+def test_draw_stars_methods():
+    t0 = Time("2020-01-01T00:00:00")
+    boresight = galsim.CelestialCoord(150*galsim.degrees, -30*galsim.degrees)
+    wcs0 = make_wcs(boresight)
+    # Slow drift so that stars trail by ~30 pixels
+    tracker = InertialTracker(
+        t0=t0,
+        boresight0=boresight,
+        rot_sky_pos0=30*galsim.degrees,
+        rot_axis=galsim.CelestialCoord(0*galsim.degrees, 90*galsim.degrees),
+        rot_rate=(45/10*galsim.arcsec).rad
+    )
+    # galsim truncates the wings of phot stamps, which biases the second
+    # moments of a Kolmogorov PSF, so compare with a compact profile.
+    psf = galsim.Gaussian(fwhm=3.0)
+
+    stars = Table()
+    ras, decs = wcs0.xyToradec(
+        np.array([-350.0, 0.0, 380.0]), np.array([-300.0, 50.0, 360.0]),
+        units='degrees'
+    )
+    stars['ra'] = ras
+    stars['dec'] = decs
+    stars['nphot'] = [2e5, 5e4, 1e5]
+
+    images = {}
+    stamp_cache = StampCache(psf)
+    for method in ['phot', 'batch', 'stamp', 'fft']:
+        image = galsim.ImageD(galsim.BoundsI(-512, 511, -512, 511))
+        out = draw_stars(
+            stars.copy(), t0=t0, exptime=10.0, wcs0=wcs0, tracker=tracker,
+            psf=psf, image=image, nsplit=4,
+            rng=np.random.default_rng(1729), method=method,
+            stamp_cache=stamp_cache
+        )
+        images[method] = image
+    assert stamp_cache.hits + stamp_cache.misses + stamp_cache.shot == 3*4
+
+    # 'auto' picks 'phot' for few stars and 'fft' from fft_threshold on
+    for fft_threshold, expected in [(5000, 'phot'), (3, 'fft')]:
+        image = galsim.ImageD(galsim.BoundsI(-512, 511, -512, 511))
+        draw_stars(
+            stars.copy(), t0=t0, exptime=10.0, wcs0=wcs0, tracker=tracker,
+            psf=psf, image=image, nsplit=4,
+            rng=np.random.default_rng(1729), fft_threshold=fft_threshold
+        )
+        np.testing.assert_array_equal(image.array, images[expected].array)
+
+    # Compare flux and first and second moments of each star
+    for x, y, nphot in zip(out['x'], out['y'], out['nphot']):
+        bounds = galsim.BoundsI(
+            int(x)-60, int(x)+60, int(y)-60, int(y)+60
+        )
+        moments = []
+        for method in ['phot', 'batch', 'stamp', 'fft']:
+            stamp = images[method][bounds]
+            yy, xx = np.mgrid[
+                bounds.ymin:bounds.ymax+1, bounds.xmin:bounds.xmax+1
+            ]
+            flux = stamp.array.sum()
+            xbar = (stamp.array*xx).sum()/flux
+            ybar = (stamp.array*yy).sum()/flux
+            ixx = (stamp.array*(xx-xbar)**2).sum()/flux
+            iyy = (stamp.array*(yy-ybar)**2).sum()/flux
+            ixy = (stamp.array*(xx-xbar)*(yy-ybar)).sum()/flux
+            moments.append((flux, xbar, ybar, ixx, iyy, ixy))
+        f1, x1, y1, *m1 = moments[0]
+        for f2, x2, y2, *m2 in moments[1:]:
+            # Photon counts are Poisson distributed
+            np.testing.assert_allclose(f1, f2, rtol=0, atol=6*np.sqrt(nphot))
+            # Centroid noise of the difference of two trails
+            sigma = np.sqrt(2*np.array(m1[:2])/nphot)
+            np.testing.assert_array_less(np.abs([x1-x2, y1-y2]), 5*sigma)
+            np.testing.assert_allclose(m1, m2, rtol=0.02, atol=0.05)
+
+
+def test_draw_stars_stationary():
+    t0 = Time("2020-01-01T00:00:00")
+    boresight = galsim.CelestialCoord(150*galsim.degrees, -30*galsim.degrees)
+    wcs0 = make_wcs(boresight)
+    tracker = SiderealTracker(boresight, 30*galsim.degrees)
+    assert tracker.is_stationary
+    psf = galsim.Gaussian(fwhm=3.0)
+
+    stars = Table()
+    x = np.array([-300.2, 10.7, 250.4])
+    y = np.array([-200.9, 40.3, 310.5])
+    stars['ra'], stars['dec'] = wcs0.xyToradec(x, y, units='degrees')
+    stars['nphot'] = [2e4, 5e4, 1e5]
+    for method in ['phot', 'batch']:
+        image = galsim.ImageD(galsim.BoundsI(-512, 511, -512, 511))
+        out = draw_stars(
+            stars.copy(), t0=t0, exptime=10.0, wcs0=wcs0, tracker=tracker,
+            psf=psf, image=image, rng=np.random.default_rng(5), method=method
+        )
+        np.testing.assert_allclose(out['x'], x, rtol=0, atol=1e-6)
+        np.testing.assert_allclose(out['y'], y, rtol=0, atol=1e-6)
+        for xc, yc, nphot in zip(x, y, stars['nphot']):
+            bounds = galsim.BoundsI(
+                int(xc)-20, int(xc)+20, int(yc)-20, int(yc)+20
+            )
+            stamp = image[bounds].array
+            yy, xx = np.mgrid[
+                bounds.ymin:bounds.ymax+1, bounds.xmin:bounds.xmax+1
+            ]
+            flux = stamp.sum()
+            np.testing.assert_allclose(flux, nphot, rtol=0, atol=5*np.sqrt(nphot))
+            # PSF sigma is ~0.9 pixels
+            atol = 5*0.9/np.sqrt(nphot)
+            np.testing.assert_allclose((stamp*xx).sum()/flux, xc, rtol=0, atol=atol)
+            np.testing.assert_allclose((stamp*yy).sum()/flux, yc, rtol=0, atol=atol)
+
+
+def test_stamp_cache():
+    boresight = galsim.CelestialCoord(150*galsim.degrees, -30*galsim.degrees)
+    wcs = make_wcs(boresight)
+    psf = galsim.Gaussian(fwhm=3.0)
+    rng = np.random.default_rng(6022)
+    # Identical trails across a small patch of the field
+    x, y = rng.uniform(-100, 100, size=(2, 200))
+    ra0, dec0 = wcs.xyToradec(x, y, units='radians')
+    ra1, dec1 = ra0, dec0 + np.deg2rad(20/3600)
+    _, ym = wcs.radecToxy(0.5*(ra0+ra1), 0.5*(dec0+dec1), units='radians')
+    flux = np.full(200, 1e4)
+    stamp_cache = StampCache(psf)
+    image = galsim.ImageD(galsim.BoundsI(-256, 255, -256, 255))
+    stamp_cache.draw(
+        ra0, dec0, ra1, dec1, x, ym, flux, wcs=wcs, image=image, rng=rng
+    )
+    assert stamp_cache.hits + stamp_cache.misses == 200
+    assert stamp_cache.hits > 150
+    assert len(stamp_cache) == stamp_cache.misses
+    np.testing.assert_allclose(image.array.sum(), flux.sum(), rtol=5e-3)
+
+    # Stamps are normalized and centered on the segment at subpixel offsets
+    for key in list(stamp_cache._kernels):
+        for px, py in [(0, 0), (3, -2), (-4, 4)]:
+            stamp = stamp_cache._get_stamp(key, px, py)
+            ny, nx = stamp.shape
+            np.testing.assert_allclose(stamp.sum(), 1, rtol=1e-3)
+            yy, xx = np.mgrid[:ny, :nx]
+            np.testing.assert_allclose(
+                (stamp*xx).sum()/stamp.sum(), nx//2 + px/stamp_cache.nsub,
+                rtol=0, atol=1e-3
+            )
+            np.testing.assert_allclose(
+                (stamp*yy).sum()/stamp.sum(), ny//2 + py/stamp_cache.nsub,
+                rtol=0, atol=1e-3
+            )
+
+
+def test_stamp_cache_tracking():
+    # Orbit tracking trails all stars across a distorted field
+    t0 = Time("2020-01-01T00:00:00")
+    boresight = galsim.CelestialCoord(150*galsim.degrees, -30*galsim.degrees)
+    wcs0 = make_wcs(boresight)
+    psf = galsim.Gaussian(fwhm=3.0)
+    rng = np.random.default_rng(1618)
+    stars = Table()
+    stars['ra'], stars['dec'] = wcs0.xyToradec(
+        *rng.uniform(-500, 500, size=(2, 400)), units='degrees'
+    )
+    stars['nphot'] = np.full(400, 1e3)
+    for length, cache_size in [(400, 2**30), (10, 2**20)]:
+        tracker = InertialTracker(
+            t0=t0,
+            boresight0=boresight,
+            rot_sky_pos0=30*galsim.degrees,
+            rot_axis=galsim.CelestialCoord(
+                0*galsim.degrees, 90*galsim.degrees
+            ),
+            rot_rate=(length*1.5/np.cos(np.pi/6)/10*galsim.arcsec).rad
+        )
+        stamp_cache = StampCache(psf, cache_size=cache_size)
+        image = galsim.ImageD(galsim.BoundsI(-512, 511, -512, 511))
+        draw_stars(
+            stars.copy(), t0=t0, exptime=10.0, wcs0=wcs0, tracker=tracker,
+            psf=psf, image=image, nsplit=1, rng=rng, method='stamp',
+            stamp_cache=stamp_cache
+        )
+        assert stamp_cache.hits + stamp_cache.misses + stamp_cache.shot == 400
+        if length > stamp_cache.max_stamp:
+            # Long trails are shot, without drawing any kernels
+            assert stamp_cache.shot == 400
+            assert len(stamp_cache) == 0
+            assert stamp_cache.nbytes == 0
+        else:
+            # Short trails share kernels, and the least recently used ones
+            # are evicted to stay within the memory limit
+            assert stamp_cache.misses < 100
+            assert 0 < len(stamp_cache) < stamp_cache.misses
+            assert stamp_cache.nbytes <= cache_size
+            assert stamp_cache.nbytes == sum(
+                table.nbytes + sum(stamp.nbytes for stamp in stamps.values())
+                for table, stamps in stamp_cache._kernels.values()
+            )
+        # Same flux on the image as shooting all segments
+        batch = galsim.ImageD(image.bounds)
+        draw_stars(
+            stars.copy(), t0=t0, exptime=10.0, wcs0=wcs0, tracker=tracker,
+            psf=psf, image=batch, nsplit=1, rng=rng, method='batch'
+        )
+        np.testing.assert_allclose(
+            image.array.sum(), batch.array.sum(), rtol=0,
+            atol=6*np.sqrt(2*batch.array.sum())
+        )
+
+
+def test_convolve_segments():
+    boresight = galsim.CelestialCoord(150*galsim.degrees, -30*galsim.degrees)
+    wcs = make_wcs(boresight)
+    psf = galsim.Kolmogorov(fwhm=3.0)
+    bounds = galsim.BoundsI(-600, 599, -500, 499)
+    # Segments of different lengths, some near tile edges
+    x0 = np.array([-300.3, 10.6, 255.2, 400.9])
+    y0 = np.array([-200.7, 20.1, 255.5, -100.2])
+    x1 = x0 + np.array([0.0, 12.3, -4.4, 25.0])
+    y1 = y0 + np.array([0.0, 3.9, 8.2, -18.5])
+    flux = np.array([1e4, 2e4, 3e4, 4e4])
+    model = _convolve_segments(
+        x0, y0, x1, y1, flux, wcs=wcs, psf=psf, bounds=bounds
+    )
+
+    # Draw each segment at its own local WCS with galsim
+    expected = galsim.ImageD(bounds)
+    for i in range(len(x0)):
+        p0 = wcs.toWorld(galsim.PositionD(x0[i], y0[i]))
+        p1 = wcs.toWorld(galsim.PositionD(x1[i], y1[i]))
+        center = galsim.PositionD(0.5*(x0[i]+x1[i]), 0.5*(y0[i]+y1[i]))
+        stamp = (galsim.Convolve(getLineGSObject(p0, p1), psf)*flux[i]).drawImage(
+            wcs=wcs.local(center), center=center
+        )
+        b = stamp.bounds & bounds
+        expected[b] += stamp[b]
+    np.testing.assert_allclose(model.sum(), flux.sum(), rtol=1e-3)
+    peak = expected.array.max()
+    np.testing.assert_allclose(model, expected.array, rtol=0, atol=0.01*peak)
+
+
+if __name__ == "__main__":
+    test_line_geometry()
+    test_local_jacobians()
+    test_adaptive_nsplit()
+    test_segment_footprints()
+    test_photon_budget()
+    test_add_background()
+    test_draw_sat()
+    test_draw_stars_methods()
+    test_draw_stars_stationary()
+    test_stamp_cache()
+    test_stamp_cache_tracking()
+    test_convolve_segments()
@@ -0,0 +1,112 @@
+import astropy.units as u
+import galsim
+import numpy as np
+import ssapy
+from astropy.time import Time
+
+from satist.tools import generate_orbit
+from satist.tracker import (
+    InertialTracker, OrbitTracker, SiderealTracker, Tracker
+)
+
+
+def check_batched(tracker, times):
+    xyz = tracker.get_boresights(times)
+    rot = tracker.get_rot_sky_positions(times)
+    assert xyz.shape == (len(times), 3)
+    assert rot.shape == (len(times),)
+    # GPS seconds are accepted in place of Times
+    np.testing.assert_array_equal(tracker.get_boresights(times.gps), xyz)
+    np.testing.assert_array_equal(tracker.get_rot_sky_positions(times.gps), rot)
+    for i, time in enumerate(times):
+        np.testing.assert_allclose(
+            xyz[i], tracker.get_boresight(time).get_xyz(), rtol=0, atol=1e-14
+        )
+        np.testing.assert_allclose(
+            rot[i], tracker.get_rot_sky_pos(time).rad, rtol=0, atol=1e-14
+        )
+
+
+def test_get_boresights():
+    t0 = Time("2020-01-01T06:00:00")
+    times = t0 + np.linspace(0, 30, 7)*u.s
+    boresight = galsim.CelestialCoord(150*galsim.degrees, 20*galsim.degrees)
+
+    inertial = InertialTracker(
+        t0=t0,
+        boresight0=boresight,
+        rot_sky_pos0=30*galsim.degrees,
+        rot_axis=galsim.CelestialCoord(10*galsim.degrees, 60*galsim.degrees),
+        rot_rate=(1*galsim.degrees).rad
+    )
+    check_batched(inertial, times)
+    check_batched(SiderealTracker(boresight, 30*galsim.degrees), times)
+
+    observer = ssapy.EarthObserver(lon=-110.0, lat=32.0, elevation=2000.0)
+    orbit = generate_orbit(
+        3e7, boresight, 30*galsim.degrees, 7e3, 0.0, observer, t0
+    )
+    tracker = OrbitTracker(
+        orbit=orbit, observer=observer, t0=t0,
+        rot_sky_pos0=30*galsim.degrees
+    )
+    check_batched(tracker, times)
+
+    # The base class loops over the scalar methods
+    class LoopTracker(Tracker):
+        def get_boresight(self, time):
+            return inertial.get_boresight(time)
+
+        def get_rot_sky_pos(self, time):
+            return inertial.get_rot_sky_pos(time)
+
+    np.testing.assert_allclose(
+        LoopTracker().get_boresights(times), inertial.get_boresights(times),
+        rtol=0, atol=1e-14
+    )
+    np.testing.assert_array_equal(
+        LoopTracker().get_rot_sky_positions(times),
+        inertial.get_rot_sky_positions(times)
+    )
+
+
+def test_fit_window():
+    t0 = Time("2020-01-01T06:00:00")
+    times = t0 + np.linspace(-5, 35, 81)*u.s
+    boresight = galsim.CelestialCoord(150*galsim.degrees, 20*galsim.degrees)
+    observer = ssapy.EarthObserver(lon=-110.0, lat=32.0, elevation=2000.0)
+    # LEO and GEO-like heights
+    for height in [5e5, 3e7]:
+        orbit = generate_orbit(
+            height, boresight, 30*galsim.degrees, 7e3, 0.0, observer, t0
+        )
+        tracker = OrbitTracker(
+            orbit=orbit, observer=observer, t0=t0,
+            rot_sky_pos0=30*galsim.degrees
+        )
+        exact = tracker.get_boresights(times)
+        error = tracker.fit_window(t0, t0+30*u.s)
+        assert error < 1e-9
+        xyz = tracker.get_boresights(times)
+        inside = (times >= t0) & (times <= t0+30*u.s)
+        np.testing.assert_allclose(xyz[inside], exact[inside], rtol=0, atol=2e-9)
+        # Outside the window, the orbit is still propagated
+        np.testing.assert_array_equal(xyz[~inside], exact[~inside])
+        np.testing.assert_allclose(
+            tracker.get_boresight(times[20]).get_xyz(), xyz[20],
+            rtol=0, atol=1e-15
+        )
+        # An interpolant that misses the tolerance isn't used
+        error = tracker.fit_window(t0, t0+30*u.s, tol=1e-15, max_deg=3)
+        assert error > 1e-15
+        np.testing.assert_array_equal(tracker.get_boresights(times), exact)
+
+    # Nothing to fit for inertial trackers
+    assert SiderealTracker(boresight, 0*galsim.degrees).fit_window(
+        t0, t0+30*u.s
+    ) == 0
+
+
+if __name__ == "__main__":
+    test_get_boresights()
+    test_fit_window()
@@ -5,8 +5,9 @@ import galsim
 from astropy.time import Time
 import astropy.units as u
 
+from satist.instrument import Instrument
 from satist.tracker import InertialTracker, transform_wcs
-from satist.wcs import radialWCS
+from satist.wcs import radialWCS, _pixel_radius
 
 dtext = """
 distortion:  # plate-scale (arcsec/micron) vs field angle (deg)
@@ -75,15 +76,88 @@ def test_transform_wcs():
         rtol=0, atol=1e-8
     )
 
-    # Did we get the same WCS back?  Try some points.
+    # Did we get the same WCS back?  Try some points within the 1 degree
+    # field around the new boresight; the SIP polynomials are only fit there.
     rng = np.random.default_rng(57721)
-    ra, dec = rng.uniform(-0.3, 0.3, size=(2, 1000))
-    x1, y1 = wcs1.radecToxy(ra, dec, units='degrees')
-    x1b, y1b = wcs1b.radecToxy(ra, dec, units='degrees')
+    du, dv = np.deg2rad(rng.uniform(-0.7, 0.7, size=(2, 1000)))
+    ra, dec = boresight1._deproject(du, dv, projection='postel')
+    x1, y1 = wcs1.radecToxy(ra, dec, units='radians')
+    x1b, y1b = wcs1b.radecToxy(ra, dec, units='radians')
 
     np.testing.assert_allclose(x1, x1b, rtol=0, atol=2e-4)
     np.testing.assert_allclose(y1, y1b, rtol=0, atol=2e-4)
 
 
+def test_radial_wcs():
+    from scipy.integrate import quad
+    from scipy.interpolate import interp1d
+
+    distortion = yaml.safe_load(dtext)['distortion']
+    pixel_scale = 25.0  # micron / pixel
+    th = np.array(distortion['th'])
+    dthdr = np.array(distortion['dthdr'])*pixel_scale
+    boresight = galsim.CelestialCoord(30*galsim.degrees, -20*galsim.degrees)
+    wcs = radialWCS(th, dthdr, boresight, n=20, order=5)
+
+    # Pixel radius should be the integral of the inverse plate scale.  The
+    # tabulated integral matches adaptive quadrature closely.
+    interp = interp1d(th, dthdr, kind='cubic')
+    rhos = np.linspace(0, th[-1], 101)
+    r = _pixel_radius(th, dthdr, rhos)
+    for rho, r1 in zip(rhos, r):
+        r2 = quad(lambda arcsec: 1./interp(arcsec/3600), 0, rho*3600,
+                  limit=200)[0]
+        np.testing.assert_allclose(r1, r2, rtol=0, atol=1e-4)
+
+    # The fitted WCS follows the same mapping, up to the residuals of the
+    # SIP fit, which dominate.
+    rng = np.random.default_rng(1234)
+    for _ in range(20):
+        rho = rng.uniform(0, 0.95*th[-1])
+        coord = boresight.greatCirclePoint(
+            galsim.CelestialCoord.from_xyz(*rng.normal(size=3)),
+            rho*galsim.degrees
+        )
+        xy = wcs.toImage(coord)
+        r = _pixel_radius(th, dthdr, rho)
+        np.testing.assert_allclose(np.hypot(xy.x, xy.y), r, rtol=0, atol=0.25)
+
+
+def test_instrument_wcs():
+    distortion = yaml.safe_load(dtext)['distortion']
+    pixel_scale = 25.0  # micron / pixel
+    instrument = Instrument(
+        image_shape=(1800, 1536),
+        gain=1.0,
+        read_noise=5.0,
+        pixel_scale=pixel_scale,
+        aperture=1.0,
+        distortion=distortion
+    )
+
+    rng = np.random.default_rng(5772)
+    for _ in range(3):
+        boresight = galsim.CelestialCoord(
+            rng.uniform(0, 360)*galsim.degrees,
+            rng.uniform(-80, 80)*galsim.degrees
+        )
+        rot_sky_pos = rng.uniform(0, 360)*galsim.degrees
+        wcs = instrument.get_wcs(boresight, rot_sky_pos)
+        wcs_fit = radialWCS(
+            distortion['th'],
+            np.array(distortion['dthdr'])*pixel_scale,
+            boresight,
+            rot_sky_pos,
+            n=8, order=3
+        )
+        x, y = rng.uniform(-800, 800, size=(2, 1000))
+        ra, dec = wcs_fit.xyToradec(x, y, units='radians')
+        x1, y1 = wcs.radecToxy(ra, dec, units='radians')
+        np.testing.assert_allclose(x, x1, rtol=0, atol=1e-3)
+        np.testing.assert_allclose(y, y1, rtol=0, atol=1e-3)
+
+
 if __name__ == "__main__":
     test_transform_wcs()
+    test_radial_wcs()
+    test_instrument_wcs()